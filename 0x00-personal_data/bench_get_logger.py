@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Caller-side latency of logger.info on the 'user_data' logger, with the
+synchronous StreamHandler and in async (queue + listener) mode.
+Output goes to /dev/null.
+
+Usage: ./bench_get_logger.py [records]
+"""
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+filtered_logger = __import__('filtered_logger')
+
+MESSAGE = "name=Marlene Wood; email=hwestiii@att.net; " \
+    "phone=(473) 401-4253; ssn=261-72-6780; password=K5?BMNv; " \
+    "ip=60ed:c396:2ff:244:bbd0:9208:26f2:93ea; " \
+    "last_login=2019-11-14 06:14:24"
+
+
+def caller_latency(records: int, **kwargs) -> List[float]:
+    """ Microseconds spent in each logger.info call by the caller """
+    logger = filtered_logger.get_logger(**kwargs)
+    latencies = []
+    for _ in range(records):
+        start = time.perf_counter()
+        logger.info(MESSAGE)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    filtered_logger.stop_logger()
+    return latencies
+
+
+if __name__ == "__main__":
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sys.stderr = open(os.devnull, "w")
+    results = [
+        ("sync", caller_latency(records)),
+        ("async", caller_latency(records, async_mode=True,
+                                 queue_size=records, block=True)),
+    ]
+    for label, latencies in results:
+        print("{:<6} median {:>7.2f} us  mean {:>7.2f} us".format(
+            label, statistics.median(latencies), statistics.mean(latencies)))
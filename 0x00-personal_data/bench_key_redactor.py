@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+lines/sec of the regex redactor (get_redactor) against the key lookup
+redactor (get_key_redactor) as the number of fields to redact grows.
+"""
+import timeit
+
+filtered_logger = __import__('filtered_logger')
+
+FIELD_COUNTS = (5, 50, 500)
+LINE = "; ".join(["name=Marlene Wood", "email=hwestiii@att.net",
+                  "ip=60ed:c396:2ff:244:bbd0:9208:26f2:93ea",
+                  "last_login=2019-11-14 06:14:24"] +
+                 ["column{}=value {}".format(i, i) for i in range(24)])
+
+
+def lines_per_sec(redact) -> float:
+    """ Best of 3 runs of redact on LINE """
+    timer = timeit.Timer(lambda: redact(LINE))
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(3, number))
+
+
+if __name__ == "__main__":
+    for count in FIELD_COUNTS:
+        fields = ("name", "email") + tuple(
+            "sensitive_field_{}".format(i) for i in range(count - 2))
+        regex = filtered_logger.get_redactor(fields, "***", ";")
+        keys = filtered_logger.get_key_redactor(fields, "***", ";")
+        assert regex(LINE) == keys(LINE)
+        before, after = lines_per_sec(regex), lines_per_sec(keys)
+        print("{:>4} fields: regex {:>10,.0f} lines/sec  keys {:>10,.0f} "
+              "lines/sec  {:.1f}x".format(
+                  count, before, after, after / before))
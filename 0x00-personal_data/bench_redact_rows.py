@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Benchmark of redact_rows against the format_row + filter_datum path
+(build the `col=val` line, then find the PII values again by regex),
+for the users table and for a wide table.
+"""
+import timeit
+
+filtered_logger = __import__('filtered_logger')
+
+ROWS = 20000
+USERS = (("name", "email", "phone", "ssn", "password", "ip", "last_login",
+          "user_agent"),
+         ("Marlene Wood", "hwestiii@att.net", "(473) 401-4253",
+          "261-72-6780", "K5?BMNv", "60ed:c396:2ff:244:bbd0:9208:26f2:93ea",
+          "2019-11-14 06:14:24", "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"))
+WIDE = (USERS[0] + tuple("column_{}".format(i) for i in range(40)),
+        USERS[1] + tuple("value {}".format(i) for i in range(40)))
+
+
+def regex_path(columns, rows) -> None:
+    """ Redact each row the way main() did before redact_rows """
+    for row in rows:
+        filtered_logger.filter_datum(
+            filtered_logger.PII_FIELDS, "***",
+            filtered_logger.format_row(columns, row), ";")
+
+
+def column_path(columns, rows) -> None:
+    """ Redact each row with redact_rows """
+    for _ in filtered_logger.redact_rows(columns, rows):
+        pass
+
+
+def rows_per_sec(function, columns, row) -> float:
+    """ Best of 3 runs of function over ROWS copies of row """
+    rows = [row] * ROWS
+    best = min(timeit.repeat(lambda: function(columns, rows),
+                             number=1, repeat=3))
+    return ROWS / best
+
+
+if __name__ == "__main__":
+    for label, (columns, row) in (("users", USERS), ("wide", WIDE)):
+        before = rows_per_sec(regex_path, columns, row)
+        after = rows_per_sec(column_path, columns, row)
+        print("{:<6} filter_datum {:>10,.0f} rows/sec  redact_rows "
+              "{:>10,.0f} rows/sec  {:.1f}x".format(
+                  label, before, after, after / before))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark and regression suite for the redaction hot path: filter_datum,
+RedactingFormatter.format and logger.info through get_logger.
+
+Every case varies the number of fields to redact, the line length, the
+separator and the share of PII pairs in the line, and records lines/sec
+and the bytes allocated per line. Results are written as JSON; when a
+baseline file exists, any case slower than the baseline by more than the
+tolerance is reported and the script exits with status 1.
+
+Usage: ./bench_redaction.py [-o results.json] [-b baseline.json]
+                            [--save-baseline] [-t 0.10]
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+
+filtered_logger = __import__('filtered_logger')
+
+FIELD_COUNTS = (5, 50)
+PAIR_COUNTS = (8, 64)
+SEPARATORS = (";", "; ")
+PII_DENSITIES = (0.0, 0.5, 1.0)
+REPEAT = 3
+
+
+def make_line(fields: List[str], pairs: int, separator: str,
+              density: float) -> str:
+    """ A `key=value` line of `pairs` pairs, `density` of them PII """
+    pii = round(pairs * density)
+    keys = [fields[i % len(fields)] for i in range(pii)] + \
+        ["column{}".format(i) for i in range(pairs - pii)]
+    return separator.join("{}=value-{:06d}".format(key, i)
+                          for i, key in enumerate(keys))
+
+
+def measure(function: Callable[[], object]) -> Dict[str, float]:
+    """ lines/sec (best of REPEAT) and bytes allocated by one call """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(REPEAT, number))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"lines_per_sec": number / best,
+            "alloc_bytes_per_line": peak - before}
+
+
+def run_suite() -> Dict[str, Dict[str, float]]:
+    """ Run every case and return its results by case name """
+    results = {}
+    devnull = open(os.devnull, "w")
+    for field_count, pairs, separator, density in itertools.product(
+            FIELD_COUNTS, PAIR_COUNTS, SEPARATORS, PII_DENSITIES):
+        fields = ["field{}".format(i) for i in range(field_count)]
+        line = make_line(fields, pairs, separator, density)
+        case = "fields={} pairs={} sep={!r} pii={}".format(
+            field_count, pairs, separator, density)
+        results["filter_datum " + case] = measure(
+            lambda: filtered_logger.filter_datum(
+                fields, "***", line, separator))
+
+    fields = list(filtered_logger.PII_FIELDS)
+    for pairs, density in itertools.product(PAIR_COUNTS, PII_DENSITIES):
+        line = make_line(fields, pairs, "; ", density)
+        case = "pairs={} pii={}".format(pairs, density)
+        formatter = filtered_logger.RedactingFormatter(fields)
+        results["RedactingFormatter.format " + case] = measure(
+            lambda: formatter.format(logging.LogRecord(
+                "user_data", logging.INFO, __file__, 0, line, None, None)))
+
+        stderr, sys.stderr = sys.stderr, devnull
+        logger = filtered_logger.get_logger()
+        try:
+            results["get_logger.info " + case] = measure(
+                lambda: logger.info(line))
+        finally:
+            filtered_logger.stop_logger()
+            sys.stderr = stderr
+    devnull.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]],
+            baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    """ Describe every case slower than its baseline beyond tolerance """
+    regressions = []
+    for case, result in sorted(results.items()):
+        if case not in baseline:
+            continue
+        before = baseline[case]["lines_per_sec"]
+        after = result["lines_per_sec"]
+        if after < before * (1 - tolerance):
+            regressions.append("{}: {:,.0f} -> {:,.0f} lines/sec "
+                               "({:+.1%})".format(case, before, after,
+                                                  after / before - 1))
+    return regressions
+
+
+def main() -> None:
+    """ Run the suite, save the results and check them against baseline """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", default="bench_results.json",
+                        help="where to write the results")
+    parser.add_argument("-b", "--baseline", default="bench_baseline.json",
+                        help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.10,
+                        help="accepted slowdown before failing (0.10)")
+    args = parser.parse_args()
+
+    results = run_suite()
+    document = {"python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results}
+    with open(args.output, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    for case, result in sorted(results.items()):
+        print("{:<60} {:>12,.0f} lines/sec {:>8,} B/line".format(
+            case, result["lines_per_sec"], result["alloc_bytes_per_line"]))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+        return
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression, file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
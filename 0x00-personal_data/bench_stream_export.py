@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Peak memory of exporting the users table through stream_users against
+the previous fetchall() export, on a local SQLite stand-in seeded with
+synthetic rows.
+
+Usage: ./bench_stream_export.py [rows] [batch_size]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+filtered_logger = __import__('filtered_logger')
+
+COLUMNS = ("name", "email", "phone", "ssn", "password", "ip",
+           "last_login", "user_agent")
+
+
+def seed(db, rows: int) -> None:
+    """ Create the users table and insert `rows` synthetic users """
+    db.execute("DROP TABLE IF EXISTS users")
+    db.execute("CREATE TABLE users ({})".format(
+        ", ".join("{} TEXT".format(col) for col in COLUMNS)))
+    db.executemany(
+        "INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (("User {}".format(i), "user{}@example.com".format(i),
+          "(473) 401-{:04d}".format(i % 10000),
+          "261-72-{:04d}".format(i % 10000), "K5?BMNv{}".format(i),
+          "10.0.{}.{}".format(i // 256 % 256, i % 256),
+          "2019-11-14 06:14:24",
+          "Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
+         for i in range(rows)))
+    db.commit()
+
+
+def export_fetchall(db) -> int:
+    """ The export as main() did it: fetchall() then redact """
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM users;")
+    rows = cursor.fetchall()
+    columns = [i[0] for i in cursor.description]
+    count = 0
+    for row in rows:
+        filtered_logger.filter_datum(
+            filtered_logger.PII_FIELDS, "***",
+            filtered_logger.format_row(columns, row), ";")
+        count += 1
+    cursor.close()
+    return count
+
+
+def export_stream(db, batch_size: int) -> int:
+    """ The export through the stream_users generator """
+    count = 0
+    for _ in filtered_logger.stream_users(db, batch_size=batch_size):
+        count += 1
+    return count
+
+
+def measure(label: str, export, *args) -> None:
+    """ Run an export and print its row count, time and peak memory """
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = export(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:<10} {:>10,} rows {:>8.2f}s  peak {:>10.1f} MiB".format(
+        label, count, elapsed, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 \
+        else filtered_logger.BATCH_SIZE
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["PERSONAL_DATA_DB_BACKEND"] = "sqlite"
+        os.environ["PERSONAL_DATA_DB_NAME"] = os.path.join(tmp, "users.db")
+        db = filtered_logger.get_db()
+        for size in (rows // 10, rows):
+            seed(db, size)
+            measure("stream", export_stream, db, batch_size)
+            measure("fetchall", export_fetchall, db)
+        db.close()
@@ -4,21 +4,29 @@ hash_password function that expects one string
 argument name password and returns a salted,
 hashed password, which is a byte string.
 """
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
 import bcrypt
 
+ROUNDS = 12
+
 
-def hash_password(password: str) -> bytes:
+def hash_password(password: str, rounds: int = ROUNDS) -> bytes:
     """
     Hashes a password using bcrypt with automatic salting.
 
     Args:
         password (str): The password to be hashed.
+        rounds (int): The bcrypt cost factor (log2 of the iterations).
 
     Returns:
         bytes: The salted, hashed password as a byte string.
     """
 
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds)
 
     hashed_password = bcrypt.hashpw(password.encode(), salt)
 
@@ -28,12 +36,76 @@ def hash_password(password: str) -> bytes:
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """
     Validates a provided password against a hashed password using bcrypt.
-    
-    Args: 
+
+    Args:
         hashed_password (bytes): hashed password
         password (str): plain text password to validate
-        
+
     Returns:
         bool: True if the password matches the hashed password, False otherwise
     """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+def hash_passwords(passwords: Iterable[str], workers: int = None,
+                   rounds: int = ROUNDS) -> List[bytes]:
+    """
+    Hashes many passwords in a thread pool: bcrypt releases the GIL
+    while hashing, so the threads run on all cores.
+
+    Args:
+        passwords (Iterable[str]): The passwords to be hashed.
+        workers (int): The number of threads (one per CPU by default).
+        rounds (int): The bcrypt cost factor.
+
+    Returns:
+        List[bytes]: The hashed passwords, in the order of passwords.
+    """
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        return list(executor.map(
+            lambda password: hash_password(password, rounds), passwords))
+
+
+def is_valid_many(pairs: Iterable[Tuple[bytes, str]],
+                  workers: int = None) -> List[bool]:
+    """
+    Validates many (hashed password, password) pairs in a thread pool.
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): The hashed passwords and the
+        plain text passwords to validate against them.
+        workers (int): The number of threads (one per CPU by default).
+
+    Returns:
+        List[bool]: is_valid of each pair, in the order of pairs.
+    """
+    with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+        return list(executor.map(lambda pair: is_valid(*pair), pairs))
+
+
+def calibrate_rounds(target: float = 0.25, min_rounds: int = 4,
+                     max_rounds: int = 31) -> int:
+    """
+    Finds the largest bcrypt cost factor whose hash takes at most
+    `target` seconds on this machine.
+
+    Each extra round doubles the hashing time, so the cost factors are
+    timed from min_rounds upwards and the search stops at the first one
+    over target: calibrating takes at most about three times the target.
+
+    Args:
+        target (float): The accepted latency of one hash, in seconds.
+        min_rounds (int): The cost factor returned even if it is slower.
+        max_rounds (int): The highest cost factor to consider.
+
+    Returns:
+        int: The cost factor to pass to hash_password.
+    """
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        hash_password("calibration", rounds + 1)
+        if time.perf_counter() - start > target:
+            break
+        rounds += 1
+    return rounds
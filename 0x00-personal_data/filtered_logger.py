@@ -2,14 +2,243 @@
 """
  a function called filter_datum that returns the log message obfuscated
 """
+import atexit
+import hashlib
+import hmac
+import json
 import os
+import queue
+import random
 import re
-from typing import List, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from operator import itemgetter
+from typing import (AbstractSet, Callable, Dict, Iterable, Iterator, List,
+                    Match, Optional, Pattern, Sequence, Tuple,
+                    Union)
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import sqlite3
 from mysql.connector.connection import MySQLConnection
 import mysql.connector
 
 PII_FIELDS: Tuple[str, ...] = ("name", "email", "ssn", "password", "phone")
+BATCH_SIZE = 1000
+QUEUE_SIZE = 10000
+REPORT_INTERVAL = 60.0
+POOL_SIZE = 5
+POOL_TIMEOUT = 30.0
+POOL_PING_INTERVAL = 30.0
+EXPORT_COLUMNS: Tuple[str, ...] = ("name", "email", "phone", "ssn", "password",
+                                   "ip", "last_login", "user_agent")
+EXPORT_KEY = "id"
+EXPORT_PUSHDOWNS: Tuple[str, ...] = ("literal", "hash")
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+REDACTOR_CACHE_SIZE = 128
+TOKEN_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def get_field_pattern(
+        fields: Tuple[str, ...],
+        separator: str) -> Pattern:
+    """
+    Compile (once) the pattern matching `=value` for each of `fields`
+    in a log line; the value is its first group.
+
+    A match starts at the `=` and looks behind it for the field name,
+    so it does not cover the name and needs no group to put it back.
+    """
+    keys = '|'.join(f"(?<={re.escape(field)}=)" for field in fields)
+    sep = re.escape(separator)
+    if len(separator) == 1:
+        value = f"[^{sep}\\n]*"
+    else:
+        value = f"(?:(?!{sep}).)*?"
+    return re.compile(f"=(?:{keys})({value})(?={sep}|$)")
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def get_redactor(
+        fields: Tuple[str, ...],
+        redaction: str,
+        separator: str) -> Callable[[str], str]:
+    """
+    Build (once) the function redacting `fields` in a log line.
+
+    The pattern is compiled a single time per (fields, separator) and
+    the redactor kept in a bounded LRU cache per (fields, redaction,
+    separator) tuple. The substitution is a plain string: no Python
+    callback runs per match.
+
+    Arguments:
+    fields: a tuple of the field names to obfuscate
+    redaction: a string representing by what the field will be obfuscated
+    separator: a string separating all fields in the log line
+
+    Returns:
+        a function taking a log line and returning it obfuscated
+    """
+    if not fields:
+        return str
+    pattern = get_field_pattern(fields, separator)
+    return partial(pattern.sub, '=' + redaction.replace('\\', r'\\'))
+
+
+class Tokenizer:
+    """
+    Deterministic redaction: a value is replaced by a token, a keyed
+    HMAC-SHA256 of it, so log lines about the same user can be joined
+    while the value can't be recovered without the key.
+
+    Tokens of the most recent values are kept in an LRU cache, so a hot
+    value (the same email logged thousands of times) is hashed once;
+    stats() reports the cache hit rate and size for tuning cache_size.
+    """
+
+    PREFIX = "tok_"
+    # Block size of SHA-256, the size of the padded HMAC keys
+    BLOCK_SIZE = 64
+
+    def __init__(self, key: bytes, cache_size: int = TOKEN_CACHE_SIZE,
+                 length: int = 16):
+        if not key:
+            raise ValueError("a token key is required")
+        self.key = key
+        self.length = length
+        self.token = lru_cache(maxsize=cache_size)(self._token)
+
+    def _token(self, value: str) -> str:
+        """ Compute the token of a value """
+        digest = hmac.new(self.key, value.encode(), hashlib.sha256)
+        return self.PREFIX + digest.hexdigest()[:self.length]
+
+    def __call__(self, value: str) -> str:
+        """ The token of a value, from the cache when possible """
+        return self.token(value)
+
+    def sql_token(self, column: str, marker: str) -> Tuple[str, tuple]:
+        """
+        SQL expression computing in the database the token of `column`:
+        the same HMAC-SHA256 as __call__, spelled with SHA2 and UNHEX
+        over the inner and outer padded keys, so exported rows and log
+        lines tokenized with the same key can be joined.
+
+        Returns:
+            the expression and its parameters, bound with `marker`
+        """
+        key = self.key
+        if len(key) > self.BLOCK_SIZE:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(self.BLOCK_SIZE, b"\0")
+        inner = bytes(byte ^ 0x36 for byte in key)
+        outer = bytes(byte ^ 0x5c for byte in key)
+        # The keys are bound in hex: raw bytes aren't valid text
+        expression = ("CONCAT({m}, SUBSTR(SHA2(CONCAT(UNHEX({m}), UNHEX("
+                      "SHA2(CONCAT(UNHEX({m}), {c}), 256))), 256), 1, {n}))"
+                      ).format(m=marker, c=column, n=self.length)
+        return expression, (self.PREFIX, outer.hex(), inner.hex())
+
+    def stats(self) -> dict:
+        """ Hits, misses, hit rate, size and bound of the token cache """
+        info = self.token.cache_info()
+        lookups = info.hits + info.misses
+        return {"hits": info.hits,
+                "misses": info.misses,
+                "hit_rate": info.hits / lookups if lookups else 0.0,
+                "size": info.currsize,
+                "maxsize": info.maxsize}
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def get_token_redactor(
+        fields: Tuple[str, ...],
+        separator: str,
+        tokenizer: Tokenizer) -> Callable[[str], str]:
+    """
+    Build (once) the function replacing the values of `fields` in a
+    log line by their tokenizer token, with the pattern of get_redactor.
+
+    Arguments:
+    fields: a tuple of the field names to tokenize
+    separator: a string separating all fields in the log line
+    tokenizer: the Tokenizer giving the token of a value
+
+    Returns:
+        a function taking a log line and returning it tokenized
+    """
+    if not fields:
+        return str
+    pattern = get_field_pattern(fields, separator)
+
+    def replace(match: Match) -> str:
+        return "=" + tokenizer(match.group(1))
+    return partial(pattern.sub, replace)
+
+
+@lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+def get_key_redactor(
+        fields: Tuple[str, ...],
+        redaction: str,
+        separator: str) -> Callable[[str], str]:
+    """
+    Build (once) a redactor giving the same output as get_redactor, but
+    without a regex alternation over the fields, whose cost grows with
+    the number of fields.
+
+    Splitting on the separator only finds the same values when no
+    character of the separator can be part of a field name, of the `=`
+    or of the line end: when one can, the redactor is get_redactor's.
+
+    The line is split once on the separator; for each `=` in a token,
+    only the suffixes of the text before it having the length of some
+    field are looked up in a hash set of the fields. The cost is linear
+    in the line length and depends on the number of distinct field
+    lengths, not on the number of fields.
+
+    Arguments:
+    fields: a tuple of the field names to obfuscate
+    redaction: a string representing by what the field will be obfuscated
+    separator: a string separating all fields in the log line
+
+    Returns:
+        a function taking a log line and returning it obfuscated
+    """
+    if not fields or not separator or \
+            set(separator) & set("=\n").union(*fields):
+        return get_redactor(fields, redaction, separator)
+    keys = frozenset(fields)
+    lengths = sorted({len(field) for field in keys})
+
+    def is_key(token: str, eq: int) -> bool:
+        for n in lengths:
+            if n > eq:
+                return False
+            if token[eq - n:eq] in keys:
+                return True
+        return False
+
+    def redact(message: str) -> str:
+        tokens = message.split(separator)
+        last = len(tokens) - 1
+        for i, token in enumerate(tokens):
+            eq = token.find("=")
+            while eq != -1:
+                if is_key(token, eq):
+                    newline = token.find("\n", eq)
+                    if newline == -1:
+                        tokens[i] = token[:eq + 1] + redaction
+                        break
+                    if i == last and newline == len(token) - 1:
+                        tokens[i] = token[:eq + 1] + redaction + "\n"
+                        break
+                eq = token.find("=", eq + 1)
+        return separator.join(tokens)
+    return redact
 
 
 def filter_datum(
@@ -31,13 +260,42 @@ def filter_datum(
     filter_datum should be less than 5 lines long and use re.sub to perform
     the substitution with a single regex.
     """
-    pattern = '|'.join([f"{field}=.*?(?={separator}|$)" for field in fields])
-    return re.sub(
-        pattern,
-        lambda m: m.group(0).split('=')[0] +
-        '=' +
-        redaction,
-        message)
+    return get_redactor(tuple(fields), redaction, separator)(message)
+
+
+class RedactedMessage(str):
+    """ A log line already redacted column by column (see redact_rows),
+    which RedactingFormatter does not scan again when it was redacted
+    as the formatter would: the same redaction, for at least its fields
+
+    The fields and redaction are class attributes of a subclass per
+    policy (see of), so a line costs no more to build than a str
+    """
+
+    fields: AbstractSet[str] = frozenset()
+    redaction: Union[str, Tokenizer] = "***"
+
+    @staticmethod
+    @lru_cache(maxsize=REDACTOR_CACHE_SIZE)
+    def of(fields: AbstractSet[str],
+           redaction: Union[str, Tokenizer]) -> type:
+        """ The RedactedMessage class of lines redacted with redaction
+        for the frozenset fields
+        """
+        return type("RedactedMessage", (RedactedMessage,),
+                    {"fields": fields, "redaction": redaction})
+
+    def covers(self, fields: Iterable[str],
+               redaction: Union[str, Tokenizer]) -> bool:
+        """ Whether the line is redacted with redaction for all of fields
+        (tokenizers with the same key and length give the same tokens)
+        """
+        def same(redaction):
+            if isinstance(redaction, Tokenizer):
+                return (Tokenizer, redaction.key, redaction.length)
+            return redaction
+        return self.fields.issuperset(fields) and \
+            same(self.redaction) == same(redaction)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -48,49 +306,451 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: Sequence[str], key_lookup: bool = False,
+                 tokenizer: Tokenizer = None):
+        """
+         key_lookup selects get_key_redactor over the regex of
+         get_redactor: same output, at a cost independent of the number
+         of fields, for very large field lists.
+         With a tokenizer, values are replaced by their token instead of
+         REDACTION (see get_token_redactor).
+        """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.tokenizer = tokenizer
+        if tokenizer is not None:
+            self.policy = (tuple(fields), tokenizer, self.SEPARATOR)
+            self.redact = get_token_redactor(
+                tuple(fields), self.SEPARATOR, tokenizer)
+        elif key_lookup:
+            self.policy = (tuple(fields), self.REDACTION, self.SEPARATOR)
+            self.redact = get_key_redactor(*self.policy)
+        else:
+            self.policy = (tuple(fields), self.REDACTION, self.SEPARATOR)
+            self.redact = get_redactor(*self.policy)
+
+    def redacted_message(self, record: logging.LogRecord) -> str:
+        """
+         the message of the record (its args interpolated) filtered with
+         filter_datum, unless it comes from redact_rows already redacted
+         as this formatter would (see RedactedMessage.covers).
+
+         The result is memoized on the record by redaction policy, so
+         every handler formatting the record with the same fields,
+         redaction and separator shares a single redaction pass.
+        """
+        cache = record.__dict__.get("_redacted_messages")
+        if cache is None:
+            cache = record._redacted_messages = {}
+        message = cache.get(self.policy)
+        if message is None:
+            if isinstance(record.msg, RedactedMessage) and \
+                    not record.args and \
+                    record.msg.covers(self.fields, self.policy[1]):
+                message = record.msg
+            else:
+                message = self.redact(record.getMessage())
+            cache[self.policy] = message
+        return message
 
     def format(self, record: logging.LogRecord) -> str:
         """
          filter values in incoming log records using filter_datum
+
+         The record itself is left untouched: its msg and args are only
+         swapped for the redacted message while it is being formatted.
+        """
+        msg, args = record.msg, record.args
+        record.msg, record.args = self.redacted_message(record), None
+        try:
+            return super().format(record)
+        finally:
+            record.msg, record.args = msg, args
+
+
+def redact_rows(columns: Sequence[str], rows: Iterable[Sequence],
+                fields: Sequence[str] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                tokenizer: Tokenizer = None
+                ) -> Iterator[RedactedMessage]:
+    """
+    Redact rows of a result set by column instead of by regex.
+
+    The PII columns are resolved once for the whole result set: the
+    redaction is baked into a format template with one slot per
+    remaining column, so each row only costs picking those values and
+    a single str.format.
+
+    Arguments:
+    columns: the column names of the result set
+    rows: the rows (tuples or lists) of the result set
+    fields: the names of the columns to obfuscate
+    redaction: a string representing by what the field will be obfuscated
+    tokenizer: when given, the fields are replaced by their token
+    instead of redaction, a row at a time
+
+    Returns:
+        an iterator over the `col=val; col=val` lines of the rows
+    """
+    fields = set(fields)
+    if tokenizer is not None:
+        tokenized = [col in fields for col in columns]
+        template = "; ".join(
+            "{}={{}}".format(col.replace("{", "{{").replace("}", "}}"))
+            for col in columns)
+        line = RedactedMessage.of(frozenset(fields), tokenizer)
+        for row in rows:
+            yield line(template.format(*(
+                tokenizer(str(value)) if token else value
+                for value, token in zip(row, tokenized))))
+        return
+    kept = [i for i, col in enumerate(columns) if col not in fields]
+    template = "; ".join(
+        "{}={}".format(col.replace("{", "{{").replace("}", "}}"),
+                       redaction.replace("{", "{{").replace("}", "}}")
+                       if col in fields else "{}")
+        for col in columns)
+    if len(kept) > 1:
+        pick = itemgetter(*kept)
+    else:
+        def pick(row):
+            return tuple(row[i] for i in kept)
+    line = RedactedMessage.of(frozenset(fields), redaction)
+    for row in rows:
+        yield line(template.format(*pick(row)))
+
+
+def redact_structure(data, fields: AbstractSet[str],
+                     redaction: str = RedactingFormatter.REDACTION,
+                     tokenizer: Tokenizer = None):
+    """
+    Copy of a structured payload where the value of every key in
+    `fields` is replaced by `redaction` (or by its token when a
+    tokenizer is given), at any depth of nested dicts and lists.
+    Keys are matched by lookup: values are never scanned.
+    """
+    if isinstance(data, dict):
+        if tokenizer is not None:
+            return {key: tokenizer(str(value)) if key in fields
+                    else redact_structure(value, fields, redaction,
+                                          tokenizer)
+                    for key, value in data.items()}
+        return {key: redaction if key in fields
+                else value if not isinstance(value, (dict, list, tuple))
+                else redact_structure(value, fields, redaction)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [redact_structure(value, fields, redaction, tokenizer)
+                for value in data]
+    return data
+
+
+class JSONRedactingFormatter(RedactingFormatter):
+    """ Redacting Formatter emitting one JSON object per record
+
+    A dict message, and the attributes passed with `extra=`, are
+    redacted by key with redact_structure and no regex; a string message
+    is still redacted with filter_datum.
+    """
+
+    RECORD_ATTRIBUTES = frozenset(
+        logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+        "message", "asctime", "_redacted_messages"}
+
+    def __init__(self, fields: Sequence[str], key_lookup: bool = False,
+                 tokenizer: Tokenizer = None):
+        super(JSONRedactingFormatter, self).__init__(
+            fields, key_lookup, tokenizer)
+        self.field_set = frozenset(fields)
+
+    def format(self, record: logging.LogRecord) -> str:
         """
-        record.msg = filter_datum(
-            self.fields,
-            self.REDACTION,
-            record.getMessage(),
-            self.SEPARATOR)
-        return super().format(record)
+         render the record as a JSON line, its payload redacted
+        """
+        if isinstance(record.msg, dict):
+            message = record.msg
+        else:
+            message = self.redacted_message(record)
+        payload = {key: record.__dict__[key] for key in
+                   record.__dict__.keys() - self.RECORD_ATTRIBUTES}
+        payload["message"] = message
+        line = {"time": self.formatTime(record),
+                "logger": record.name,
+                "level": record.levelname}
+        line.update(redact_structure(payload, self.field_set,
+                                     self.REDACTION, self.tokenizer))
+        if record.exc_info:
+            line["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class BatchingStreamHandler(logging.StreamHandler):
+    """ StreamHandler buffering formatted records and writing them to
+    the stream in batches of at most `capacity` records
+    """
+
+    def __init__(self, stream=None, capacity: int = BATCH_SIZE):
+        super(BatchingStreamHandler, self).__init__(stream)
+        self.capacity = capacity
+        self.buffer: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """ Format the record into the buffer, writing it out when full """
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+            if len(self.buffer) >= self.capacity:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """ Write the buffered records with a single write, then flush """
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write("".join(self.buffer))
+                self.buffer = []
+            super(BatchingStreamHandler, self).flush()
+        finally:
+            self.release()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """ QueueHandler for a bounded queue: when the queue is full, the
+    record is dropped (and counted) unless `block` is set, in which case
+    the caller waits for the listener to make room
+    """
+
+    def __init__(self, log_queue: queue.Queue, block: bool = False):
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.block = block
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Enqueue the record as is: the message is interpolated and
+        redacted by the listener thread, not by the caller
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Put the record on the queue following the full-queue policy """
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RedactingListener(QueueListener):
+    """ QueueListener flushing its handlers whenever the queue runs dry,
+    so records are written in batches while the queue is busy
+    """
+
+    def handle(self, record: logging.LogRecord) -> None:
+        """ Handle a record, flushing once the queue is empty """
+        super(RedactingListener, self).handle(record)
+        if self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+
+    def enqueue_sentinel(self) -> None:
+        """ Queue the stop sentinel, waiting for room in a full queue
+        (put_nowait would raise queue.Full there)
+        """
+        self.queue.put(self._sentinel)
+
+    def stop(self) -> None:
+        """ Drain the queue, stop the thread and flush the handlers """
+        super(RedactingListener, self).stop()
+        for handler in self.handlers:
+            handler.flush()
 
 
-def get_logger() -> logging.Logger:
+class SamplingFilter(logging.Filter):
+    """
+    Logger filter deciding whether a record is kept before any handler
+    (and so RedactingFormatter) sees it.
+
+    A record is first sampled with the ratio of its level (1.0 when the
+    level has none), then must take a token from a bucket refilled with
+    `rate` tokens per second, holding at most `burst` (the larger of
+    `rate` and 1 by default: a bucket of less than one token would
+    never let a record through). Every
+    `report_interval` seconds, the counts of kept, sampled out and rate
+    limited records are logged to the handlers of the logger.
+    """
+
+    def __init__(self, ratios: Dict[int, float] = None, rate: float = None,
+                 burst: int = None, report_interval: float = REPORT_INTERVAL):
+        super(SamplingFilter, self).__init__()
+        self.ratios = dict(ratios or {})
+        if burst is not None and burst < 1:
+            raise ValueError("burst must hold at least one token")
+        self.rate = rate
+        if burst is None and rate is not None:
+            burst = max(1, rate)
+        self.burst = burst
+        self.tokens = self.burst
+        self.report_interval = report_interval
+        self.kept = self.sampled_out = self.rate_limited = 0
+        self.lock = threading.Lock()
+        self.refilled_at = self.reported_at = time.monotonic()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """ Whether the record is kept """
+        with self.lock:
+            now = time.monotonic()
+            keep = self._sample(record, now)
+            report = now - self.reported_at >= self.report_interval
+            if report:
+                counts = (self.kept, self.sampled_out, self.rate_limited)
+                self.kept = self.sampled_out = self.rate_limited = 0
+                self.reported_at = now
+        if report:
+            self._report(record.name, *counts)
+        return keep
+
+    def _sample(self, record: logging.LogRecord, now: float) -> bool:
+        """ Apply the level ratio then the token bucket, counting both """
+        ratio = self.ratios.get(record.levelno, 1.0)
+        if ratio < 1.0 and random.random() >= ratio:
+            self.sampled_out += 1
+            return False
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.rate_limited += 1
+                return False
+            self.tokens -= 1
+        self.kept += 1
+        return True
+
+    @staticmethod
+    def _report(name: str, kept: int, sampled_out: int,
+                rate_limited: int) -> None:
+        """ Send the counters straight to the handlers of the logger """
+        logger = logging.getLogger(name)
+        logger.callHandlers(logger.makeRecord(
+            name, logging.INFO, __file__, 0,
+            "kept={}; sampled_out={}; rate_limited={}".format(
+                kept, sampled_out, rate_limited), None, None))
+
+
+_listener: Optional[RedactingListener] = None
+
+
+def stop_logger() -> None:
+    """
+    Detach the handlers of the 'user_data' logger and, in async mode,
+    stop its listener after every queued record has been written
+    """
+    global _listener
+    logger = logging.getLogger("user_data")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    for log_filter in list(logger.filters):
+        if isinstance(log_filter, SamplingFilter):
+            logger.removeFilter(log_filter)
+    try:
+        if _listener is not None:
+            _listener.stop()
+    finally:
+        _listener = None
+        logger.redacting_config = None
+
+
+def get_logger(async_mode: bool = False,
+               queue_size: int = QUEUE_SIZE,
+               block: bool = False,
+               structured: bool = False,
+               tokenize: bool = False,
+               sample: Dict[int, float] = None,
+               rate_limit: float = None,
+               burst: int = None) -> logging.Logger:
     """
     Creates and returns a logger named 'user_data' with a
     RedactingFormatter
+
+    Calling it again with the same arguments returns the logger as is;
+    different arguments replace its handlers.
+
+    Arguments:
+    async_mode: when True, logger.info only enqueues the record and a
+    background listener redacts and writes it in batches
+    queue_size: the bound of the queue in async mode
+    block: in async mode, wait for room in a full queue instead of
+    dropping the record
+    structured: emit JSON lines with JSONRedactingFormatter, so dicts
+    can be logged and are redacted by key
+    tokenize: replace values by their Tokenizer token, keyed with
+    PERSONAL_DATA_TOKEN_KEY, instead of REDACTION
+    sample: the ratio of records kept per level, e.g. {logging.INFO: 0.1}
+    rate_limit: the records per second kept at most (token bucket)
+    burst: the size of the token bucket, at least 1 (rate_limit or 1
+    by default)
     """
+    global _listener
     logger = logging.getLogger("user_data")
+    config = (async_mode, queue_size, block, structured, tokenize,
+              sample, rate_limit, burst)
+    if getattr(logger, "redacting_config", None) == config:
+        return logger
+    # Built first: without a token key, the current handlers are kept
+    tokenizer = None
+    if tokenize:
+        tokenizer = Tokenizer(
+            os.getenv("PERSONAL_DATA_TOKEN_KEY", "").encode())
+    stop_logger()
+
     logger.setLevel(logging.INFO)
 
     logger.propagate = False
 
-    stream_handler = logging.StreamHandler()
+    formatter_class = JSONRedactingFormatter if structured \
+        else RedactingFormatter
+    formatter = formatter_class(PII_FIELDS, tokenizer=tokenizer)
+
+    if sample or rate_limit is not None:
+        logger.addFilter(SamplingFilter(sample, rate_limit, burst))
 
-    stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
+    if async_mode:
+        stream_handler = BatchingStreamHandler()
+        stream_handler.setFormatter(formatter)
+        log_queue = queue.Queue(queue_size)
+        _listener = RedactingListener(log_queue, stream_handler)
+        _listener.start()
+        logger.addHandler(BoundedQueueHandler(log_queue, block))
+    else:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        logger.addHandler(stream_handler)
 
-    logger.addHandler(stream_handler)
+    logger.redacting_config = config
     return logger
 
 
+atexit.register(stop_logger)
+
+
 def get_db() -> MySQLConnection:
     """
     Connect to the MySQL database using credentials from
     environment variables.
 
+    Setting PERSONAL_DATA_DB_BACKEND=sqlite returns the local SQLite
+    stand-in from get_sqlite_db instead.
+
     Returns:
         MySQLConnection: A Connection object to interact
         with the database
     """
+    if os.getenv("PERSONAL_DATA_DB_BACKEND", "mysql") == "sqlite":
+        return get_sqlite_db()
 
     username = os.getenv("PERSONAL_DATA_DB_USERNAME", "root")
     password = os.getenv("PERSONAL_DATA_DB_PASSWORD", "")
@@ -106,25 +766,429 @@ def get_db() -> MySQLConnection:
 
     return connection
 
-def main():
-    """ Main function that retrieves all rows from users table and logs them """
-    db = get_db()
+
+def get_sqlite_db() -> sqlite3.Connection:
+    """
+    SQLite stand-in for get_db, to run exports locally without a
+    MySQL server. PERSONAL_DATA_DB_NAME is the path of the database
+    file (an in-memory database when unset).
+
+    The MySQL functions used by the redacted exports (SHA2, CONCAT,
+    UNHEX) are registered on the connection so the same SQL runs on
+    both.
+
+    Returns:
+        sqlite3.Connection: A Connection object exposing the same
+        DB-API cursor interface as MySQLConnection
+    """
+    connection = sqlite3.connect(
+        os.getenv("PERSONAL_DATA_DB_NAME", ":memory:"),
+        check_same_thread=False)
+    connection.create_function("SHA2", 2, _sha2)
+    connection.create_function("CONCAT", -1, _concat)
+    connection.create_function("UNHEX", 1, _unhex)
+    return connection
+
+
+def _sha2(value, bits: int) -> Optional[str]:
+    """ MySQL SHA2(): hex digest of the SHA-2 family member of `bits` """
+    if value is None:
+        return None
+    algorithm = {0: "sha256", 224: "sha224", 256: "sha256",
+                 384: "sha384", 512: "sha512"}.get(bits)
+    if algorithm is None:
+        return None
+    if type(value) is not bytes:
+        value = str(value).encode()
+    return hashlib.new(algorithm, value).hexdigest()
+
+
+def _concat(*values) -> Union[str, bytes, None]:
+    """
+    MySQL CONCAT(): NULL as soon as one argument is NULL, a binary
+    string as soon as one argument is binary
+    """
+    if any(value is None for value in values):
+        return None
+    if any(type(value) is bytes for value in values):
+        return b"".join(value if type(value) is bytes
+                        else str(value).encode() for value in values)
+    return "".join(str(value) for value in values)
+
+
+def _unhex(value) -> Optional[bytes]:
+    """ MySQL UNHEX(): the bytes of a hex string, NULL if it isn't one """
+    try:
+        return bytes.fromhex(str(value))
+    except ValueError:
+        return None
+
+
+class ConnectionPool:
+    """
+    Pool of at most `size` database connections, reused across
+    checkouts instead of paying a connect (TCP handshake and auth) for
+    every batch.
+
+    `connect` is the backend: any callable returning a DB-API
+    connection (get_db by default, so PERSONAL_DATA_DB_BACKEND and the
+    other PERSONAL_DATA_DB_* variables pick and configure it).
+    A connection idle for more than `ping_interval` seconds is checked
+    with `SELECT 1` before being handed out, and replaced if dead.
+    """
+
+    def __init__(self, connect: Callable = None, size: int = POOL_SIZE,
+                 timeout: float = POOL_TIMEOUT,
+                 ping_interval: float = POOL_PING_INTERVAL):
+        self.connect = connect or get_db
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout: float = None):
+        """
+        Check a connection out of the pool, opening one if none is idle.
+
+        Raises:
+            TimeoutError: all `size` connections stayed checked out for
+            `timeout` seconds (the pool timeout by default)
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(
+                "no database connection available after {}s".format(timeout))
+        try:
+            while True:
+                try:
+                    connection, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                if time.monotonic() - idle_since < self.ping_interval \
+                        or self.is_healthy(connection):
+                    return connection
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, discard: bool = False) -> None:
+        """ Give a checked out connection back to the pool, or close it
+        when `discard` is set or it can't be rolled back
+        """
+        try:
+            if discard:
+                self._discard(connection)
+                return
+            try:
+                connection.rollback()
+            except Exception:
+                self._discard(connection)
+                return
+            self._idle.put((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Context manager checking a connection out for the `with` block;
+        the connection is discarded if the block raises
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def is_healthy(self, connection) -> bool:
+        """ Whether the connection still answers a trivial query """
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        """ Close every idle connection """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+    @staticmethod
+    def _discard(connection) -> None:
+        """ Close a connection, ignoring errors of a dead one """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Return the process-wide pool over get_db, created on first use.
+    PERSONAL_DATA_DB_POOL_SIZE, PERSONAL_DATA_DB_POOL_TIMEOUT and
+    PERSONAL_DATA_DB_POOL_PING override the pool defaults.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                get_db,
+                size=int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE",
+                                   POOL_SIZE)),
+                timeout=float(os.getenv("PERSONAL_DATA_DB_POOL_TIMEOUT",
+                                        POOL_TIMEOUT)),
+                ping_interval=float(os.getenv("PERSONAL_DATA_DB_POOL_PING",
+                                              POOL_PING_INTERVAL)))
+            atexit.register(_pool.close)
+        return _pool
+
+
+def format_row(columns: Sequence[str], row: Sequence) -> str:
+    """ Render a row as the `col=val; col=val` log line """
+    return "; ".join(f"{col}={val}" for col, val in zip(columns, row))
+
+
+def fetch_batches(cursor, batch_size: int = BATCH_SIZE) -> Iterator[tuple]:
+    """
+    Yield the rows of an executed cursor, fetchmany() batch_size rows
+    at a time, so at most one batch is held in memory.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def stream_users(db, fields: Sequence[str] = PII_FIELDS,
+                 batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """
+    Stream the users table as redacted log lines.
+
+    The cursor is unbuffered (the default for mysql.connector and
+    sqlite3): rows are read from the server batch by batch instead of
+    the whole result set being fetched first, so memory stays flat
+    whatever the table size.
+
+    Arguments:
+    db: a connection returned by get_db
+    fields: the fields to obfuscate
+    batch_size: the number of rows fetched per round trip
+
+    Returns:
+        an iterator over the redacted lines
+    """
     cursor = db.cursor()
+    try:
+        cursor.execute("SELECT * FROM users;")
+        columns = [i[0] for i in cursor.description]
+        yield from redact_rows(
+            columns, fetch_batches(cursor, batch_size), fields)
+    finally:
+        cursor.close()
 
-    cursor.execute("SELECT * FROM users;")
-    rows = cursor.fetchall()
 
-    columns = [i[0] for i in cursor.description]
-    
-    logger = get_logger()
+def placeholder(db) -> str:
+    """ The query parameter marker of the connection's driver """
+    return "?" if isinstance(db, sqlite3.Connection) else "%s"
 
-    for row in rows:
-        row_data = "; ".join(f"{col}={val}" for col, val in zip(columns, row))
-        logger.info(row_data)
 
-    cursor.close()
-    db.close()
+def check_identifiers(*names: str) -> None:
+    """ Refuse table/column names that would need quoting in SQL """
+    for name in names:
+        if not IDENTIFIER.match(name):
+            raise ValueError("invalid SQL identifier: {!r}".format(name))
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    """ The checkpoint saved at path, None when there is none """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """ Atomically replace the checkpoint at path """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_users(db, checkpoint_path: str,
+                 columns: Sequence[str] = EXPORT_COLUMNS,
+                 key: str = EXPORT_KEY,
+                 fields: Sequence[str] = PII_FIELDS,
+                 batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """
+    Resumable export of the users table as redacted log lines.
+
+    The table is walked in `key` order with keyset pagination
+    (`WHERE key > last ORDER BY key LIMIT batch_size`), selecting only
+    `columns` and the key. Once every line of a batch has been consumed,
+    the last key is saved to checkpoint_path; a later call with the same
+    checkpoint resumes after it instead of starting over. The checkpoint
+    is removed when the export completes.
+
+    Arguments:
+    db: a connection returned by get_db
+    checkpoint_path: the file keeping the progress of the export
+    columns: the columns to export
+    key: the primary key (unique and indexed) of the users table
+    fields: the fields to obfuscate
+    batch_size: the number of rows per query
+
+    Returns:
+        an iterator over the redacted lines
+    """
+    check_identifiers(key, *columns)
+    checkpoint = load_checkpoint(checkpoint_path) or \
+        {"last_key": None, "rows": 0}
+    select = "SELECT {}, {} FROM users".format(", ".join(columns), key)
+    order = " ORDER BY {} LIMIT {}".format(key, int(batch_size))
+    after = " WHERE {} > {}".format(key, placeholder(db))
+    cursor = db.cursor()
+    try:
+        while True:
+            if checkpoint["last_key"] is None:
+                cursor.execute(select + order)
+            else:
+                cursor.execute(select + after + order,
+                               (checkpoint["last_key"],))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            yield from redact_rows(columns, rows, fields)
+            checkpoint["last_key"] = rows[-1][-1]
+            checkpoint["rows"] += len(rows)
+            save_checkpoint(checkpoint_path, checkpoint)
+            if len(rows) < batch_size:
+                break
+    finally:
+        cursor.close()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def redacted_select(db, columns: Sequence[str] = EXPORT_COLUMNS,
+                    fields: Sequence[str] = PII_FIELDS,
+                    token_key: str = None,
+                    redaction: str = RedactingFormatter.REDACTION
+                    ) -> Tuple[str, tuple]:
+    """
+    Build the SELECT of the users table where the database itself
+    redacts the PII columns: each comes back as the redaction literal,
+    or, when a token_key is given, as the Tokenizer token of the value
+    with that key (see Tokenizer.sql_token): the token the log lines
+    carry, so rows can be joined with them and with each other.
+
+    Returns:
+        the query and its parameters
+    """
+    check_identifiers(*columns)
+    marker = placeholder(db)
+    tokenizer = None if token_key is None \
+        else Tokenizer(token_key.encode())
+    expressions, params = [], []
+    for column in columns:
+        if column not in fields:
+            expressions.append(column)
+        elif token_key is None:
+            expressions.append("{} AS {}".format(marker, column))
+            params.append(redaction)
+        else:
+            expression, token_params = tokenizer.sql_token(column, marker)
+            expressions.append("{} AS {}".format(expression, column))
+            params.extend(token_params)
+    return ("SELECT {} FROM users".format(", ".join(expressions)),
+            tuple(params))
+
+
+def export_users_redacted(db, columns: Sequence[str] = EXPORT_COLUMNS,
+                          fields: Sequence[str] = PII_FIELDS,
+                          token_key: str = None,
+                          batch_size: int = BATCH_SIZE
+                          ) -> Iterator[RedactedMessage]:
+    """
+    Export the users table with the redaction pushed down into the
+    query (see redacted_select): the plaintext PII never crosses the
+    wire nor enters this process, and no redaction runs in Python.
+
+    Arguments:
+    db: a connection returned by get_db
+    columns: the columns to export
+    fields: the fields to obfuscate
+    token_key: the key of the tokens of the PII columns, as for
+    get_logger(tokenize=True); they are replaced by the redaction
+    literal when None
+    batch_size: the number of rows fetched per round trip
+
+    Returns:
+        an iterator over the redacted lines
+    """
+    query, params = redacted_select(db, columns, fields, token_key)
+    line = RedactedMessage.of(frozenset(fields), RedactingFormatter.REDACTION
+                              if token_key is None
+                              else Tokenizer(token_key.encode()))
+    cursor = db.cursor()
+    try:
+        cursor.execute(query, params)
+        for row in fetch_batches(cursor, batch_size):
+            yield line(format_row(columns, row))
+    finally:
+        cursor.close()
+
+
+def main():
+    """ Main function that retrieves all rows from users table and logs them """
+    batch_size = int(os.getenv("PERSONAL_DATA_BATCH_SIZE", BATCH_SIZE))
+    checkpoint_path = os.getenv("PERSONAL_DATA_EXPORT_CHECKPOINT")
+    pushdown = os.getenv("PERSONAL_DATA_EXPORT_PUSHDOWN")
+    if pushdown and pushdown not in EXPORT_PUSHDOWNS:
+        raise ValueError("PERSONAL_DATA_EXPORT_PUSHDOWN must be one of "
+                         "{}, not {!r}".format(", ".join(EXPORT_PUSHDOWNS),
+                                               pushdown))
+    token_key = os.getenv("PERSONAL_DATA_TOKEN_KEY") \
+        if pushdown == "hash" else None
+    if pushdown == "hash" and not token_key:
+        raise ValueError("PERSONAL_DATA_TOKEN_KEY is required to hash")
+    with get_pool().connection() as db:
+        logger = get_logger()
+        if pushdown:
+            lines = export_users_redacted(db, token_key=token_key,
+                                          batch_size=batch_size)
+        elif checkpoint_path:
+            lines = export_users(
+                db, checkpoint_path,
+                key=os.getenv("PERSONAL_DATA_EXPORT_KEY", EXPORT_KEY),
+                batch_size=batch_size)
+        else:
+            lines = stream_users(db, batch_size=batch_size)
+
+        for line in lines:
+            logger.info(line)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Main file
+"""
+import sqlite3
+
+ConnectionPool = __import__('filtered_logger').ConnectionPool
+get_sqlite_db = __import__('filtered_logger').get_sqlite_db
+
+pool = ConnectionPool(get_sqlite_db, size=1, timeout=0.1, ping_interval=60)
+
+# Checkout timeout: the only connection is held
+first = pool.acquire()
+try:
+    pool.acquire()
+    print("no timeout")
+except TimeoutError:
+    print("timeout")
+pool.release(first)
+
+# Reuse: the released connection is handed out again
+with pool.connection() as db:
+    print(db is first)
+
+# Idle ping: a dead idle connection is replaced
+pool.ping_interval = 0
+first.close()
+with pool.connection() as db:
+    print(db is first)
+    print(db.execute("SELECT 1").fetchone())
+second = db
+
+# Discard on error: the connection is closed, not pooled
+try:
+    with pool.connection() as db:
+        raise RuntimeError("query failed")
+except RuntimeError:
+    pass
+try:
+    second.execute("SELECT 1")
+    print("still open")
+except sqlite3.ProgrammingError:
+    print("closed")
+with pool.connection() as db:
+    print(db is second)
+
+pool.close()
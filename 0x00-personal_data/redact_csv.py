@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Redact the PII columns of a large CSV dump (shaped like user_data.csv)
+in parallel.
+
+The file is mmapped and split into byte ranges ending on a newline that
+is outside any quoted field; a process pool redacts the ranges and the
+results are written back in file order.
+
+Usage: ./redact_csv.py user_data.csv -o redacted.csv [-w workers]
+"""
+import argparse
+import csv
+import io
+import mmap
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import List, Sequence, Tuple
+
+filtered_logger = __import__('filtered_logger')
+
+CHUNK_SIZE = 16 * 2 ** 20
+
+
+def split_ranges(mm: mmap.mmap, start: int,
+                 chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Split mm[start:] into ranges of about chunk_size bytes, each ending
+    right after a newline which is not inside a quoted field: a range
+    boundary is only accepted when the range holds an even number of
+    quote characters (escaped quotes are doubled, so they count twice).
+    """
+    ranges = []
+    size = len(mm)
+    while start < size:
+        end = start + chunk_size
+        quotes = 0
+        scanned = start
+        while end < size:
+            newline = mm.find(b"\n", end)
+            if newline == -1:
+                end = size
+                break
+            quotes += mm[scanned:newline].count(b'"')
+            scanned = newline
+            end = newline + 1
+            if quotes % 2 == 0:
+                break
+        end = min(end, size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def redact_range(path: str, start: int, end: int, indexes: Sequence[int],
+                 redaction: str, lineterminator: str = "\n"
+                 ) -> Tuple[bytes, int, float, int]:
+    """
+    Redact the CSV rows held in path[start:end], ending each written row
+    with lineterminator (the one of the header, so the endings of the
+    output don't mix).
+
+    Returns:
+        the redacted bytes, the number of rows, the seconds spent and
+        the pid of the worker
+    """
+    began = time.perf_counter()
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8")
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator=lineterminator)
+    rows = 0
+    for row in csv.reader(io.StringIO(text, newline="")):
+        for i in indexes:
+            if i < len(row):
+                row[i] = redaction
+        writer.writerow(row)
+        rows += 1
+    return (out.getvalue().encode("utf-8"), rows,
+            time.perf_counter() - began, os.getpid())
+
+
+def _redact_task(task: tuple) -> Tuple[bytes, int, float, int]:
+    """ Unpack a task for Pool.imap """
+    return redact_range(*task)
+
+
+def main() -> None:
+    """ Parse the command line and redact the file """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="CSV file with a header line")
+    parser.add_argument("-o", "--output", help="output file (stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("-f", "--fields", nargs="+",
+                        default=list(filtered_logger.PII_FIELDS),
+                        help="columns to redact")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="approximate bytes per range")
+    args = parser.parse_args()
+
+    if os.path.getsize(args.path) == 0:
+        parser.error("{} is empty".format(args.path))
+    with open(args.path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header_end = mm.find(b"\n") + 1 or len(mm)
+        header = mm[:header_end]
+        ranges = split_ranges(mm, header_end, args.chunk_size)
+    lineterminator = "\r\n" if header.endswith(b"\r\n") else "\n"
+    columns = next(csv.reader([header.decode("utf-8")]))
+    indexes = [i for i, col in enumerate(columns) if col in args.fields]
+    redaction = filtered_logger.RedactingFormatter.REDACTION
+    tasks = [(args.path, start, end, indexes, redaction, lineterminator)
+             for start, end in ranges]
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    stats = {}
+    began = time.perf_counter()
+    try:
+        out.write(header)
+        with Pool(args.workers) as pool:
+            for data, rows, seconds, pid in pool.imap(_redact_task, tasks):
+                out.write(data)
+                worker = stats.setdefault(pid, [0, 0.0])
+                worker[0] += rows
+                worker[1] += seconds
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    elapsed = time.perf_counter() - began
+
+    total = 0
+    for pid, (rows, seconds) in sorted(stats.items()):
+        total += rows
+        print("worker {}: {:,} rows, {:,.0f} rows/sec".format(
+            pid, rows, rows / seconds if seconds else 0), file=sys.stderr)
+    print("total: {:,} rows in {:.2f}s, {:,.0f} rows/sec".format(
+        total, elapsed, total / elapsed if elapsed else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,42 @@ from models.user import User
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: number of Users of the page
+      - offset: number of Users skipped before the page
+      - order_by: attribute to order by, '-' first for descending
+      - cursor: X-Next-Cursor of the previous page
     Return:
-      - list of all User objects JSON represented
+      - list of all User objects JSON represented, or of one page of
+        them with the cursor of the next page in X-Next-Cursor
+      - 400 if a query parameter is wrong
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if not request.args:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', type=int)
+    order_by = request.args.get('order_by')
+    if 'limit' in request.args and (limit is None or limit < 1):
+        return jsonify({'error': "Wrong limit"}), 400
+    if 'offset' in request.args and (offset is None or offset < 0):
+        return jsonify({'error': "Wrong offset"}), 400
+    if order_by is not None and order_by.lstrip('-').startswith('_'):
+        return jsonify({'error': "Wrong order_by"}), 400
+    try:
+        # One User more tells whether there is a next page
+        users = list(User.search(
+            limit=None if limit is None else limit + 1,
+            offset=offset or 0, cursor=request.args.get('cursor'),
+            order_by=order_by))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify([user.to_json() for user in users[:limit]])
+    if limit is not None and len(users) > limit:
+        response.headers['X-Next-Cursor'] = \
+            users[limit - 1].cursor(order_by or 'id')
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -2,36 +2,101 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Union, Iterator
+from os import getenv
+import base64
 import json
 import uuid
 
+# DATA, the objects of the file storage, stays importable from here
+from models.engine.file_storage import DATA, FileStorage
+from models.engine.sqlite_storage import SQLiteStorage
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+# An unset slot
+MISSING = object()
+SLOT_NAMES = {}
+
+if getenv("MODELS_STORAGE", "json") == "sqlite":
+    storage = SQLiteStorage(timestamp_format=TIMESTAMP_FORMAT)
+else:
+    storage = FileStorage()
+
+
+def format_timestamp(value: datetime) -> str:
+    """ Format a datetime with TIMESTAMP_FORMAT: isoformat gives the same
+    string twice as fast for naive datetimes (strftime doesn't pad the
+    years before 1000)
+    """
+    if TIMESTAMP_FORMAT == "%Y-%m-%dT%H:%M:%S" and value.tzinfo is None \
+            and value.year >= 1000:
+        return value.isoformat(timespec='seconds')
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string: fromisoformat is many times
+    faster than strptime and reads the same strings. Binary snapshots
+    give datetimes, which are kept
+    """
+    if type(value) is datetime:
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def encode_cursor(order_by: str, value, obj_id: str) -> str:
+    """ Opaque, URL-safe cursor of the position of an object in the
+    order order_by: the search goes on after it
+    """
+    if type(value) is datetime:
+        value = {'datetime': value.isoformat()}
+    cursor = json.dumps([order_by, value, obj_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ order_by, value and ID of an encode_cursor cursor; ValueError
+    if it isn't one
+    """
+    try:
+        order_by, value, obj_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()))
+        if type(value) is dict:
+            value = datetime.fromisoformat(value['datetime'])
+    except Exception:
+        raise ValueError("invalid cursor")
+    if type(order_by) is not str or type(obj_id) is not str:
+        raise ValueError("invalid cursor")
+    return order_by, value, obj_id
 
 
 class Base():
     """ Base class
     """
 
+    # No per-instance __dict__: millions of objects stay small
+    __slots__ = ('id', 'created_at', 'updated_at')
+
+    # Attributes indexed by the storage for the equality lookups of search
+    indexes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        if 'id' in kwargs:
+            self.id = kwargs['id']
+        else:
+            self.id = str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs['created_at'])
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs['updated_at'])
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,69 +109,69 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def slot_names(cls) -> tuple:
+        """ Names of the slots of the class, base classes first
+        """
+        names = SLOT_NAMES.get(cls)
+        if names is None:
+            names = tuple(name for klass in reversed(cls.__mro__)
+                          for name in klass.__dict__.get('__slots__', ())
+                          if name not in ('__dict__', '__weakref__'))
+            SLOT_NAMES[cls] = names
+        return names
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        items = [(key, getattr(self, key, MISSING))
+                 for key in self.slot_names()]
+        items.extend(getattr(self, '__dict__', {}).items())
+        for key, value in items:
             if not for_serialization and key[0] == '_':
                 continue
+            if value is MISSING:
+                continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
 
     @classmethod
-    def load_from_file(cls):
+    def load_from_file(cls, stream: bool = None):
         """ Load all objects from file
-        """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        With stream (MODELS_STREAM_LOAD by default), the file storage
+        parses the file one object at a time. The reads below then
+        pick up the writes of other processes, see FileStorage.refresh
+        """
+        storage.load(cls, stream)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
-
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        storage.dump(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        storage.save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage.remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        storage.refresh(cls)
+        return storage.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +183,47 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        storage.refresh(cls)
+        return storage.get(cls, id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = {}, limit: int = None,
+               offset: int = 0, cursor: str = None,
+               order_by: str = None) -> Union[List[TypeVar('Base')],
+                                              Iterator[TypeVar('Base')]]:
         """ Search all objects with matching attributes
+
+        Without limit, offset, cursor or order_by, return them all in a
+        list. With any of them, return a lazy iterator in the order of
+        the attribute order_by (ID by default, '-' first for descending;
+        None comes last in ascending order, so first in descending),
+        starting after the object of cursor (see Base.cursor),
+        skipping offset of them and stopping after limit.
+        ValueError on an unknown attribute, a negative limit or offset,
+        or a cursor of another order
+        """
+        storage.refresh(cls)
+        if limit is None and not offset and cursor is None \
+                and order_by is None:
+            return storage.search(cls, attributes)
+
+        order_by = order_by or 'id'
+        if order_by.lstrip('-') not in cls.slot_names():
+            raise ValueError("can't order by {}".format(order_by))
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError("limit and offset can't be negative")
+        after = None
+        if cursor is not None:
+            cursor_order, value, obj_id = decode_cursor(cursor)
+            if cursor_order != order_by:
+                raise ValueError("cursor of another order")
+            after = (value, obj_id)
+        return storage.iter_search(cls, attributes, order_by, after,
+                                   offset, limit)
+
+    def cursor(self, order_by: str = 'id') -> str:
+        """ Cursor of search(order_by=order_by, ...) to go on after this
+        object
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        value = getattr(self, order_by.lstrip('-'), None)
+        return encode_cursor(order_by, value, self.id)
@@ -8,11 +8,41 @@ from models.user import User
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def get_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: number of Users of the page
+      - offset: number of Users skipped before the page
+      - order_by: attribute to order by, '-' first for descending
+      - cursor: X-Next-Cursor of the previous page
     Return:
-      - list of all User objects JSON representation
+      - list of all User objects JSON representation, or of one page
+        of them with the cursor of the next page in X-Next-Cursor
     """
-    users = User.all()
-    return jsonify([user.to_json() for user in users])
+    if not request.args:
+        users = User.all()
+        return jsonify([user.to_json() for user in users])
+
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', type=int)
+    order_by = request.args.get('order_by')
+    if 'limit' in request.args and (limit is None or limit < 1):
+        abort(400, description="Wrong limit")
+    if 'offset' in request.args and (offset is None or offset < 0):
+        abort(400, description="Wrong offset")
+    if order_by is not None and order_by.lstrip('-').startswith('_'):
+        abort(400, description="Wrong order_by")
+    try:
+        # One User more tells whether there is a next page
+        users = list(User.search(
+            limit=None if limit is None else limit + 1,
+            offset=offset or 0, cursor=request.args.get('cursor'),
+            order_by=order_by))
+    except ValueError as e:
+        abort(400, description=str(e))
+    response = jsonify([user.to_json() for user in users[:limit]])
+    if limit is not None and len(users) > limit:
+        response.headers['X-Next-Cursor'] = \
+            users[limit - 1].cursor(order_by or 'id')
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
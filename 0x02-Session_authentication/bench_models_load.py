@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" Cold-start time and peak RSS growth of User.load_from_file() on a
+.db_User.json of synthetic users, read at once and stream-parsed. Each
+step is a fresh process: a child inherits the peak RSS of its parent.
+
+Usage: ./bench_models_load.py [users ...]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from models.user import User
+
+
+def write_users(count: int) -> None:
+    """ Write `count` synthetic users to .db_User.json """
+    objs_json = {}
+    for i in range(count):
+        obj_id = "{:08x}-0000-4000-8000-{:012x}".format(i, i)
+        objs_json[obj_id] = {"id": obj_id,
+                             "created_at": "2024-01-01T00:00:00",
+                             "updated_at": "2024-01-01T00:00:00",
+                             "email": "user{}@example.com".format(i),
+                             "_password": "{:064x}".format(i),
+                             "first_name": "First{}".format(i),
+                             "last_name": "Last{}".format(i)}
+    with open(".db_User.json", "w") as f:
+        json.dump(objs_json, f)
+
+
+def measure(mode: str) -> None:
+    """ Load .db_User.json and print the time and peak RSS growth """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "stream":
+        User.load_from_file(stream=True)
+    else:
+        User.load_from_file()
+    elapsed = time.perf_counter() - start
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    print("{:>9,} users {:<7} {:>7.2f}s  peak +{:>7.1f} MiB".format(
+        User.count(), mode, elapsed, size / 1024))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--write":
+        write_users(int(sys.argv[2]))
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        measure(sys.argv[2])
+        sys.exit(0)
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    script = os.path.abspath(__file__)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(script))
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            subprocess.run([sys.executable, script, "--write", str(count)],
+                           cwd=tmp, env=env, check=True)
+            for mode in ("load", "stream"):
+                subprocess.run([sys.executable, script, "--child", mode],
+                               cwd=tmp, env=env, check=True)
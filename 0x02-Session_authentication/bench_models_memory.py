@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+""" Memory held by User objects stored in models.base.DATA, with their
+indexes, at 100k and 1M users: the growth of the peak RSS of a fresh
+process per count (ru_maxrss is in KiB on Linux).
+
+Usage: ./bench_models_memory.py [users ...]
+"""
+import resource
+import subprocess
+import sys
+import time
+
+from models.base import DATA, storage
+from models.user import User
+
+
+def store_users(count: int) -> None:
+    """ Create and index `count` users the way load_from_file does """
+    DATA['User'] = {}
+    storage.rebuild_indexes(User)
+    for i in range(count):
+        user = User(id="{:08x}-0000-4000-8000-{:012x}".format(i, i),
+                    created_at="2024-01-01T00:00:00",
+                    updated_at="2024-01-01T00:00:00",
+                    email="user{}@example.com".format(i),
+                    _password="{:064x}".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        DATA['User'][user.id] = user
+        storage.add_to_indexes(user)
+
+
+def measure(count: int) -> None:
+    """ Print the peak RSS growth while storing `count` users """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    store_users(count)
+    elapsed = time.perf_counter() - start
+    size = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+    size *= 1024
+    print("{:>9,} users {:>9.1f} MiB {:>6,} B/user  ({:.1f}s)".format(
+        count, size / 2 ** 20, size // count, elapsed))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        measure(int(sys.argv[2]))
+        sys.exit(0)
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        subprocess.run([sys.executable, __file__, "--child", str(count)],
+                       check=True)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+""" Time to fetch pages of users ordered by email: by cursor, by offset
+and by sorting the whole search, near the start and near the end of
+200k users by default.
+
+Usage: ./bench_models_pages.py [users] [page size]
+Set MODELS_STORAGE to measure another storage.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from models.base import storage
+from models.engine import file_storage
+from models.user import User
+
+
+def timed(fetch, repeat: int = 20) -> float:
+    """ Mean time of fetch() in milliseconds """
+    fetch()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fetch()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        # Journal the saves: a snapshot per save is quadratic
+        file_storage.JOURNAL = True
+        User.load_from_file()
+        for i in range(count):
+            User(email="user{:08d}@example.com".format(
+                (i * 7919) % count)).save()
+        storage.flush()
+        print("{:,} users, pages of {} by email".format(count, size))
+        for at in (0, count - size - 1):
+            user = next(iter(User.search(order_by='email', offset=at,
+                                         limit=1)))
+            cursor = user.cursor('email')
+            by_cursor = timed(lambda: list(User.search(
+                limit=size, cursor=cursor, order_by='email')))
+            by_offset = timed(lambda: list(User.search(
+                offset=at + 1, limit=size, order_by='email')), 3)
+            by_sort = timed(lambda: sorted(
+                User.search(), key=lambda u: (u.email, u.id))[
+                    at + 1:at + 1 + size], 3)
+            print("after {:>9,}: cursor {:>8.2f}ms  offset {:>8.2f}ms  "
+                  "sort {:>8.2f}ms".format(at, by_cursor, by_offset,
+                                           by_sort))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+""" Latency of User.save() as the number of stored users grows, with
+full-file rewrites, in journal mode and in write-behind mode.
+
+Usage: ./bench_models_save.py [saves]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from models.base import DATA, storage
+from models.engine import file_storage
+from models.user import User
+
+SIZES = (1000, 10000, 50000)
+
+
+def seed(size: int) -> None:
+    """ Store `size` users and write them as the snapshot """
+    DATA['User'] = {}
+    for i in range(size):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i), last_name="Last")
+        user.password = "pwd{}".format(i)
+        DATA['User'][user.id] = user
+    User.save_to_file()
+
+
+def save_latency(size: int, saves: int, journal: bool,
+                 write_behind: float = 0) -> float:
+    """ Median milliseconds of one save() with `size` stored users """
+    file_storage.JOURNAL = journal
+    file_storage.WRITE_BEHIND = write_behind
+    file_storage.JOURNAL_MAX_BYTES = 2 ** 40
+    seed(size)
+    latencies = []
+    for i in range(saves):
+        user = User(email="new{}@example.com".format(i))
+        start = time.perf_counter()
+        user.save()
+        latencies.append((time.perf_counter() - start) * 1e3)
+    storage.flush()
+    return statistics.median(latencies)
+
+
+if __name__ == "__main__":
+    saves = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        for size in SIZES:
+            rewrite = save_latency(size, saves, False)
+            journal = save_latency(size, saves, True)
+            behind = save_latency(size, saves, False, 0.5)
+            print("{:>7,} users  rewrite {:>9.3f} ms  journal {:>7.3f} ms  "
+                  "write-behind {:>7.3f} ms".format(size, rewrite, journal,
+                                                    behind))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+""" Save time, load time and file size of the JSON and binary snapshot
+formats of the file storage, at 1M users by default.
+
+Usage: ./bench_models_snapshot.py [users]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from models.base import DATA, storage
+from models.engine import file_storage
+from models.user import User
+
+
+def store_users(count: int) -> None:
+    """ Store `count` synthetic users in DATA """
+    DATA['User'] = {}
+    for i in range(count):
+        user = User(id="{:08x}-0000-4000-8000-{:012x}".format(i, i),
+                    created_at="2024-01-01T00:00:00",
+                    updated_at="2024-01-01T00:00:00",
+                    email="user{}@example.com".format(i),
+                    _password="{:064x}".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+        DATA['User'][user.id] = user
+
+
+def measure(snapshot_format: str) -> None:
+    """ Print the save and load times and the size of one format """
+    file_storage.SNAPSHOT_FORMAT = snapshot_format
+    start = time.perf_counter()
+    User.save_to_file()
+    saved = time.perf_counter() - start
+    size = os.path.getsize(storage.snapshot_path(User))
+    count = User.count()
+
+    start = time.perf_counter()
+    User.load_from_file()
+    loaded = time.perf_counter() - start
+    assert User.count() == count
+    print("{:<7} save {:>6.2f}s  load {:>6.2f}s  size {:>8.1f} MiB".format(
+        snapshot_format, saved, loaded, size / 2 ** 20))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        store_users(count)
+        print("{:,} users".format(count))
+        for snapshot_format in ("json", "binary"):
+            measure(snapshot_format)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+""" Convert a models snapshot between the JSON format (.db_<Class>.json)
+and the binary format (.db_<Class>.bin), in the direction given by the
+extension of the source file.
+
+Usage: ./convert_snapshot.py .db_User.json .db_User.bin
+       ./convert_snapshot.py .db_User.bin .db_User.json
+"""
+import argparse
+import json
+from datetime import datetime
+
+from models.base import TIMESTAMP_FORMAT
+from models.engine.file_storage import (iter_binary_objects,
+                                        write_binary_atomic,
+                                        write_json_atomic)
+
+
+def json_to_binary(source: str, destination: str) -> int:
+    """ Write the objects of a JSON snapshot as a binary snapshot """
+    with open(source, 'r') as f:
+        objs_json = json.load(f)
+    write_binary_atomic(destination, objs_json)
+    return len(objs_json)
+
+
+def binary_to_json(source: str, destination: str) -> int:
+    """ Write the objects of a binary snapshot as a JSON snapshot """
+    objs_json = {}
+    for obj_id, obj_json in iter_binary_objects(source):
+        for key, value in obj_json.items():
+            if type(value) is datetime:
+                obj_json[key] = value.strftime(TIMESTAMP_FORMAT)
+        objs_json[obj_id] = obj_json
+    write_json_atomic(destination, objs_json)
+    return len(objs_json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", help=".json or .bin snapshot to read")
+    parser.add_argument("destination", help="snapshot to write")
+    args = parser.parse_args()
+    if args.source.endswith(".bin"):
+        count = binary_to_json(args.source, args.destination)
+    else:
+        count = json_to_binary(args.source, args.destination)
+    print("{} objects written to {}".format(count, args.destination))
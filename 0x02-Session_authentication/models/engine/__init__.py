@@ -0,0 +1,4 @@
+#!/usr/bin/env python3
+""" Storage engines of the models: models.base picks one with the
+MODELS_STORAGE environment variable
+"""
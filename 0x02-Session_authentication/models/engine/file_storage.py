@@ -0,0 +1,1157 @@
+#!/usr/bin/env python3
+""" File storage engine: every object lives in the DATA dict, mirrored
+to a .db_<Class>.json (or .bin) file per class
+"""
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import (TypeVar, Callable, List, Iterable, Iterator, IO,
+                    TextIO, Tuple)
+from os import getenv, path
+import atexit
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+
+DATA = {}
+INDEXES = {}
+INDEXED_VALUES = {}
+# A value left out of the indexes, or a field absent from an object
+MISSING = object()
+# Sorted indexes, by class then attribute: the sorted list of the
+# sort_key of every object and the key of each id. Readers and writers
+# only hold SORTED_LOCK to bisect and slice or insert
+SORTED = {}
+SORTED_LOCK = threading.Lock()
+# Keys read from a sorted index at a time by iter_search
+SORTED_CHUNK = 256
+VALUE_END = re.compile(r"\s*[,:}]")
+
+# json, or binary for the .db_<Class>.bin format of write_binary
+SNAPSHOT_FORMAT = getenv("MODELS_SNAPSHOT_FORMAT", "json")
+BINARY_MAGIC = b"MODELS"
+BINARY_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+# created_at or updated_at absent or None
+NO_TIMESTAMP = -2 ** 63
+# Type tags of the binary fields
+TAG_STR, TAG_NONE, TAG_JSON, TAG_ABSENT = range(4)
+
+STREAM_LOAD = getenv("MODELS_STREAM_LOAD", "0").lower() in ("1", "true",
+                                                            "yes")
+JOURNAL = getenv("MODELS_JOURNAL", "0").lower() in ("1", "true", "yes")
+JOURNAL_MAX_BYTES = int(getenv("MODELS_JOURNAL_MAX_BYTES", 8 * 2 ** 20))
+JOURNALS = {}
+COMPACTING = set()
+# Held by writers around their changes to DATA, the indexes and the
+# journal; readers only take it to apply the writes of other processes
+LOCK = threading.RLock()
+# Orders the snapshot writes: an older snapshot is never renamed over
+# a newer one. Taken before LOCK
+DUMP_LOCK = threading.Lock()
+
+# Seconds during which writes are coalesced before a background flush;
+# 0 writes within save() and remove()
+WRITE_BEHIND = float(getenv("MODELS_WRITE_BEHIND", 0))
+DIRTY = {}
+DIRTY_CHANGED = threading.Condition()
+# Seconds before the flusher tries again after a failed flush
+FLUSH_RETRY = 1
+LOGGER = logging.getLogger(__name__)
+# Records in DATA whose snapshot isn't written yet, by class
+WRITING = {}
+FLUSH_LOCK = threading.Lock()
+
+# Seconds between two checks for the writes of other processes; a
+# negative value turns the checks off
+REFRESH_INTERVAL = float(getenv("MODELS_REFRESH_INTERVAL", 1))
+# What this process last read or wrote of the files of each class: the
+# stat_key of the snapshot, and the (inode, offset) reached in the
+# journals
+SYNCED = {}
+CHECKED = {}
+
+
+def iter_json_object(f: TextIO, chunk_size: int = 2 ** 16
+                     ) -> Iterator[Tuple[str, object]]:
+    """ Yield the (key, value) pairs of the JSON object stored in f,
+    reading chunk_size characters at a time: the whole document is
+    never held in memory, only the value being decoded
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    state = "open"
+    key = None
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\n\r":
+            pos += 1
+        if pos < len(buf) and state in ("key", "value"):
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # Until the delimiter after it is read, a value may go on in
+            # the next chunk (a number cut after '1.' for instance)
+            if end is not None and (eof or VALUE_END.match(buf, end)):
+                pos = end
+                if state == "value":
+                    yield key, value
+                    state = "next"
+                elif type(value) is str:
+                    key, state = value, "colon"
+                else:
+                    raise ValueError("Expected a key at {}".format(pos))
+                continue
+        elif pos < len(buf):
+            char = buf[pos]
+            pos += 1
+            if (state, char) in (("first", "}"), ("next", "}")):
+                return
+            if state == "first":
+                pos -= 1
+                state = "key"
+            elif (state, char) == ("open", "{"):
+                state = "first"
+            elif (state, char) == ("colon", ":"):
+                state = "value"
+            elif (state, char) == ("next", ","):
+                state = "key"
+            else:
+                raise ValueError("Unexpected {!r} in JSON object".format(char))
+            continue
+        if eof:
+            raise ValueError("Unexpected end of JSON object")
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+
+def stat_key(file_path: str) -> tuple:
+    """ Inode, size and mtime of file_path, or None when it doesn't
+    exist: a file renamed over it always has another inode
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+@contextmanager
+def file_lock(file_path: str, blocking: bool = True) -> Iterator[bool]:
+    """ Hold an exclusive flock on file_path, created if needed. Taken
+    on a descriptor of its own, it excludes the other threads as well
+    as the other processes. Without blocking, yields False instead of
+    waiting for it
+    """
+    fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+            locked = True
+        except BlockingIOError:
+            locked = False
+        yield locked
+    finally:
+        os.close(fd)
+
+
+def write_atomic(file_path: str, write: Callable[[IO], None],
+                 binary: bool = False) -> tuple:
+    """ Call write on a temporary file, fsync it and rename it over
+    file_path: a crash leaves either the old or the new file. Returns
+    the stat_key of the new file
+    """
+    tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    with open(tmp_path, 'wb' if binary else 'w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(tmp_path, file_path)
+    # The rename itself is only durable once the directory is synced
+    dir_fd = os.open(path.dirname(path.abspath(file_path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def write_json_atomic(file_path: str, objs_json: dict) -> tuple:
+    """ Write objs_json as a JSON snapshot, atomically
+    """
+    return write_atomic(file_path, lambda f: json.dump(objs_json, f))
+
+
+def to_epoch(value) -> int:
+    """ Seconds since the epoch of a timestamp string or datetime
+    """
+    if value is None:
+        return NO_TIMESTAMP
+    if type(value) is not datetime:
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH) // ONE_SECOND
+
+
+def sort_key(obj, attr: str) -> tuple:
+    """ Key of obj in the sorted index of attr: by value, None last,
+    then by id
+    """
+    value = getattr(obj, attr, None)
+    return (value is None, value, obj.id)
+
+
+def entry_id(entry: dict) -> str:
+    """ Id of the object of a save/remove journal record
+    """
+    return entry['obj']['id'] if entry['op'] == 'save' else entry['id']
+
+
+def same_version(obj, obj_json: dict) -> bool:
+    """ Whether obj holds the values of obj_json. Snapshots keep
+    updated_at to the second, so a differing one is enough to tell
+    versions apart, an equal one isn't
+    """
+    updated_at = obj_json.get('updated_at')
+    if type(updated_at) is str:
+        try:
+            updated_at = datetime.fromisoformat(updated_at)
+        except ValueError:
+            return False
+    saved_at = getattr(obj, 'updated_at', None)
+    if type(saved_at) is not datetime or type(updated_at) is not datetime:
+        return False
+    if saved_at.replace(microsecond=0) != updated_at:
+        return False
+    for key, value in obj_json.items():
+        if key not in ('created_at', 'updated_at') and \
+                getattr(obj, key, MISSING) != value:
+            return False
+    return True
+
+
+def write_binary(f: IO, objs_json: Iterable[dict]):
+    """ Write objects, as to_json(True) returns them, in the binary
+    snapshot format:
+
+    - header: BINARY_MAGIC, the version and the number of fields (two
+      little-endian u16), then each field name (u16 length + UTF-8)
+    - one record per object: its length (u32), then one struct holding
+      created_at and updated_at (i64 epoch seconds), the length in
+      characters of the id and of every field (i32) and the type tag of
+      every field (u8), then the text of the id and the fields, UTF-8
+      encoded as one string
+
+    A field is stored as a string, None, JSON text for any other value,
+    or absent
+    """
+    objs_json = list(objs_json)
+    fields = {}
+    for obj_json in objs_json:
+        fields.update(dict.fromkeys(obj_json))
+    for name in ('id', 'created_at', 'updated_at'):
+        fields.pop(name, None)
+    fields = list(fields)
+
+    header = [BINARY_MAGIC, struct.pack("<HH", BINARY_VERSION, len(fields))]
+    for name in fields:
+        encoded = name.encode()
+        header.append(struct.pack("<H", len(encoded)) + encoded)
+    f.write(b"".join(header))
+
+    record = struct.Struct("<qq{}i{}B".format(len(fields) + 1, len(fields)))
+    length = struct.Struct("<I")
+    for obj_json in objs_json:
+        texts = [obj_json['id']]
+        lengths = [len(obj_json['id'])]
+        tags = []
+        for name in fields:
+            value = obj_json.get(name, MISSING)
+            if type(value) is str:
+                tags.append(TAG_STR)
+            elif value is None:
+                tags.append(TAG_NONE)
+                value = ""
+            elif value is MISSING:
+                tags.append(TAG_ABSENT)
+                value = ""
+            else:
+                tags.append(TAG_JSON)
+                value = json.dumps(value)
+            texts.append(value)
+            lengths.append(len(value))
+        text = "".join(texts).encode()
+        fixed = record.pack(to_epoch(obj_json.get('created_at')),
+                            to_epoch(obj_json.get('updated_at')),
+                            *lengths, *tags)
+        f.write(length.pack(len(fixed) + len(text)) + fixed + text)
+
+
+def write_binary_atomic(file_path: str, objs_json: dict) -> tuple:
+    """ Write objs_json as a binary snapshot, atomically
+    """
+    return write_atomic(file_path,
+                        lambda f: write_binary(f, objs_json.values()),
+                        binary=True)
+
+
+def iter_binary_objects(file_path: str) -> Iterator[Tuple[str, dict]]:
+    """ Yield the (id, object) pairs of a binary snapshot, read through
+    mmap one record at a time; timestamps are returned as datetimes
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(BINARY_MAGIC) + 4:
+            raise ValueError("{} is not a binary snapshot".format(file_path))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+                raise ValueError("{} is not a binary snapshot".format(
+                    file_path))
+            pos = len(BINARY_MAGIC)
+            version, count = struct.unpack_from("<HH", mm, pos)
+            if version != BINARY_VERSION:
+                raise ValueError("{}: unsupported version {}".format(
+                    file_path, version))
+            pos += 4
+            fields = []
+            for _ in range(count):
+                size, = struct.unpack_from("<H", mm, pos)
+                fields.append(mm[pos + 2:pos + 2 + size].decode())
+                pos += 2 + size
+
+            record = struct.Struct("<qq{}i{}B".format(count + 1, count))
+            length = struct.Struct("<I")
+            # datetimes are immutable: objects saved in the same second
+            # share one, which is faster to get than to build
+            timestamps = {NO_TIMESTAMP: None}
+            # Index in the record values of the length of each field
+            columns = list(enumerate(fields, 3))
+            end = len(mm)
+            while pos < end:
+                size, = length.unpack_from(mm, pos)
+                values = record.unpack_from(mm, pos + 4)
+                text = mm[pos + 4 + record.size:pos + 4 + size].decode()
+                pos += 4 + size
+
+                created_at = timestamps.get(values[0], MISSING)
+                if created_at is MISSING:
+                    created_at = EPOCH + timedelta(seconds=values[0])
+                    timestamps[values[0]] = created_at
+                updated_at = timestamps.get(values[1], MISSING)
+                if updated_at is MISSING:
+                    updated_at = EPOCH + timedelta(seconds=values[1])
+                    timestamps[values[1]] = updated_at
+                start = values[2]
+                obj_id = text[:start]
+                obj_json = {'id': obj_id, 'created_at': created_at,
+                            'updated_at': updated_at}
+                if created_at is None or updated_at is None:
+                    # Left out of the object that was written
+                    for name in ('created_at', 'updated_at'):
+                        if obj_json[name] is None:
+                            del obj_json[name]
+                for i, name in columns:
+                    stop = start + values[i]
+                    tag = values[i + count]
+                    if tag == TAG_STR:
+                        obj_json[name] = text[start:stop]
+                    elif tag == TAG_NONE:
+                        obj_json[name] = None
+                    elif tag == TAG_JSON:
+                        obj_json[name] = json.loads(text[start:stop])
+                    start = stop
+                yield obj_id, obj_json
+
+
+class FileStorage():
+    """ Keeps the objects of each class in DATA, indexed on the indexes
+    of the class, and writes them to .db_<Class>.json: as a full
+    snapshot per write, or as records appended to .db_<Class>.journal
+    with MODELS_JOURNAL, inline or behind with MODELS_WRITE_BEHIND
+
+    Writers serialize on LOCK. Readers don't lock: they work on a copy
+    of the dict they read (dict.copy() runs in C without letting other
+    threads in), so they never block on writers and never see a dict
+    change size under them
+
+    Processes sharing the files (one per worker) write them under the
+    flock of .db_<Class>.lock, and each picks up the writes of the
+    others with refresh: a stat of the files at most once per
+    MODELS_REFRESH_INTERVAL seconds, then only the new journal
+    records, or the objects that changed in a rewritten snapshot
+    """
+
+    def __init__(self):
+        """ Initialize the storage and flush it at exit
+        """
+        self.flusher = None
+        atexit.register(self.flush)
+
+    def load(self, cls: type, stream: bool = None):
+        """ Load all objects of cls from file
+
+        With stream (STREAM_LOAD by default), the file is parsed one
+        object at a time instead of as a whole document
+
+        The files are read under LOCK and the lock file of cls, so no
+        journal is moved meanwhile. A compaction renames its snapshot
+        and then drops the journal it folded without them: when the
+        snapshot changed during the read, it is read again
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with LOCK, file_lock(".db_{}.lock".format(s_class)):
+            while True:
+                file_path = self.snapshot_file(cls)
+                snapshot = stat_key(file_path)
+                DATA[s_class] = {}
+                objs = DATA[s_class]
+                for obj_id, obj_json in self.iter_snapshot(file_path,
+                                                           stream):
+                    objs[obj_id] = cls(**obj_json)
+                self.rebuild_indexes(cls)
+
+                # A compaction cut short leaves its journal next to the
+                # snapshot
+                compacting = path.exists(journal_path + ".compacting")
+                entries, position = self.read_journals(cls, (None, 0))
+                self.apply_entries(cls, entries)
+                if self.snapshot_file(cls) == file_path and \
+                        stat_key(file_path) == snapshot:
+                    break
+            SYNCED[s_class] = {'snapshot': snapshot, 'journal': position}
+            CHECKED[s_class] = time.monotonic()
+        if path.exists(journal_path):
+            compacting |= path.getsize(journal_path) >= JOURNAL_MAX_BYTES
+        if compacting:
+            self.start_compaction(cls)
+
+    def snapshot_path(self, cls: type) -> str:
+        """ The snapshot file of cls in SNAPSHOT_FORMAT
+        """
+        extension = "bin" if SNAPSHOT_FORMAT == "binary" else "json"
+        return ".db_{}.{}".format(cls.__name__, extension)
+
+    def snapshot_file(self, cls: type) -> str:
+        """ The snapshot file of cls to read: a binary snapshot is first
+        written by the next dump, until then the JSON one is read
+        """
+        file_path = self.snapshot_path(cls)
+        if not path.exists(file_path) and SNAPSHOT_FORMAT == "binary":
+            file_path = ".db_{}.json".format(cls.__name__)
+        return file_path
+
+    def iter_snapshot(self, file_path: str, stream: bool = None
+                      ) -> Iterator[Tuple[str, dict]]:
+        """ Yield the (id, object) pairs of a snapshot, if it exists
+        """
+        if stream is None:
+            stream = STREAM_LOAD
+        if file_path.endswith(".bin"):
+            yield from iter_binary_objects(file_path)
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                if stream:
+                    yield from iter_json_object(f)
+                else:
+                    yield from json.load(f).items()
+
+    def write_snapshot(self, file_path: str, objs_json: dict) -> tuple:
+        """ Write objs_json to file_path, atomically, in the format its
+        extension names; returns the stat_key of the new file
+        """
+        if file_path.endswith(".bin"):
+            return write_binary_atomic(file_path, objs_json)
+        return write_json_atomic(file_path, objs_json)
+
+    def read_journals(self, cls: type, position: tuple
+                      ) -> Tuple[dict, tuple]:
+        """ Read the records of the journals of cls, the one being
+        compacted then the current one, past position: the (inode,
+        offset) returned by a previous read, or (None, 0) for all of
+        them. Returns the last record of each id and the new position;
+        the position is None when its journal is gone
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        journals = []
+        try:
+            for file_path in (journal_path + ".compacting", journal_path):
+                try:
+                    journals.append(open(file_path, 'rb'))
+                except FileNotFoundError:
+                    pass
+            inodes = [os.fstat(f.fileno()).st_ino for f in journals]
+            inode, start = position
+            if inode is None:
+                first = 0
+            elif inode in inodes:
+                # The journals before it were read in full
+                first = inodes.index(inode)
+            else:
+                return {}, None
+            entries = {}
+            position = (None, 0)
+            for f, inode in zip(journals[first:], inodes[first:]):
+                f.seek(start)
+                data = f.read()
+                # A record being appended is read once complete
+                end = data.rfind(b"\n") + 1
+                for line in data[:end].splitlines():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last record of a crashed process may be
+                        # cut short
+                        continue
+                    if entry.get('op') in ('save', 'remove'):
+                        entries[entry_id(entry)] = entry
+                position = (inode, start + end)
+                start = 0
+            return entries, position
+        finally:
+            for f in journals:
+                f.close()
+
+    def apply_entries(self, cls: type, entries: dict,
+                      keep: Iterable[str] = ()):
+        """ Apply the save/remove records of read_journals to DATA,
+        except those of the ids in keep
+        """
+        objs = DATA.setdefault(cls.__name__, {})
+        for obj_id, entry in entries.items():
+            if obj_id in keep:
+                continue
+            if entry['op'] == 'save':
+                obj = cls(**entry['obj'])
+                objs[obj_id] = obj
+                self.add_to_indexes(obj)
+            else:
+                objs.pop(obj_id, None)
+                self.remove_from_indexes(cls, obj_id)
+
+    def merge_snapshot(self, cls: type, file_path: str,
+                       keep: Iterable[str] = ()):
+        """ Bring DATA to the objects of a snapshot, except those of the
+        ids in keep: only the objects with another updated_at are
+        built, and those missing from the snapshot are dropped
+        """
+        objs = DATA.setdefault(cls.__name__, {})
+        seen = set()
+        for obj_id, obj_json in self.iter_snapshot(file_path):
+            seen.add(obj_id)
+            if obj_id in keep:
+                continue
+            obj = objs.get(obj_id)
+            if obj is not None and same_version(obj, obj_json):
+                continue
+            obj = cls(**obj_json)
+            objs[obj_id] = obj
+            self.add_to_indexes(obj)
+        for obj_id in [obj_id for obj_id in objs
+                       if obj_id not in seen and obj_id not in keep]:
+            del objs[obj_id]
+            self.remove_from_indexes(cls, obj_id)
+
+    def pending_ids(self, cls: type) -> set:
+        """ Ids of the objects of cls waiting for the write-behind
+        flusher or for their snapshot
+        """
+        with DIRTY_CHANGED:
+            return {entry_id(entry) for entries in
+                    (DIRTY.get(cls, ()), WRITING.get(cls, ()))
+                    for entry in entries}
+
+    def files_changed(self, cls: type, synced: dict) -> bool:
+        """ Whether the files of cls changed since synced: a stat of
+        each, without LOCK
+        """
+        if stat_key(self.snapshot_file(cls)) != synced['snapshot']:
+            return True
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        if path.exists(journal_path + ".compacting"):
+            return True
+        inode, offset = synced['journal']
+        journal = stat_key(journal_path)
+        if journal is None:
+            return inode is not None
+        return journal[0] != inode or journal[1] != offset
+
+    def sync(self, cls: type, keep: Iterable[str] = ()):
+        """ Apply to DATA what other processes wrote to the files of cls
+        since this one last read or wrote them: the records appended to
+        the journals, or once the snapshot was rewritten, the objects of
+        the new snapshot that differ from DATA and then the journals
+
+        The objects of the ids in keep, of the records waiting for the
+        flusher and of the last records written by this process are
+        newer in DATA and are left alone. LOCK is only taken when the
+        files changed, so reads don't wait for writers otherwise
+        """
+        s_class = cls.__name__
+        synced = SYNCED.get(s_class)
+        if synced is not None and not self.files_changed(cls, synced):
+            return
+        with LOCK:
+            synced = SYNCED.get(s_class)
+            if synced is None:
+                # Nothing read or written yet: there is no base to
+                # compare the files with
+                return
+            keep = set(keep)
+            keep.update(self.pending_ids(cls))
+            file_path = self.snapshot_file(cls)
+            snapshot = stat_key(file_path)
+            entries, position = self.read_journals(cls, synced['journal'])
+            rewritten = snapshot != synced['snapshot'] or position is None
+            if rewritten:
+                entries, position = self.read_journals(cls, (None, 0))
+            pid = os.getpid()
+            keep.update(obj_id for obj_id, entry in entries.items()
+                        if entry.get('pid') == pid)
+            if rewritten:
+                self.merge_snapshot(cls, file_path, keep.union(entries))
+            self.apply_entries(cls, entries, keep)
+            synced['snapshot'] = snapshot
+            synced['journal'] = position
+
+    def refresh(self, cls: type):
+        """ Sync cls with the writes of other processes, at most once
+        per REFRESH_INTERVAL seconds: other calls only read the clock
+        """
+        if REFRESH_INTERVAL < 0:
+            return
+        s_class = cls.__name__
+        now = time.monotonic()
+        checked = CHECKED.get(s_class)
+        if checked is not None and now - checked < REFRESH_INTERVAL:
+            return
+        CHECKED[s_class] = now
+        self.sync(cls)
+
+    def rebuild_indexes(self, cls: type):
+        """ Index every object of cls from scratch
+        """
+        s_class = cls.__name__
+        with LOCK:
+            INDEXES[s_class] = {attr: {} for attr in cls.indexes}
+            INDEXED_VALUES[s_class] = {}
+            # Sorted again by the next ordered search
+            with SORTED_LOCK:
+                SORTED.pop(s_class, None)
+            for obj in DATA.get(s_class, {}).values():
+                self.add_to_indexes(obj)
+
+    def add_to_indexes(self, obj: TypeVar('Base')):
+        """ Index obj under the current values of its indexed attributes,
+        replacing the entries of its previous save
+
+        A value held by one object maps to its id, and to an ordered set
+        of ids (the keys of a dict) once several objects share it
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        if SORTED.get(s_class):
+            self.add_to_sorted(obj)
+        if not cls.indexes:
+            return
+        if s_class not in INDEXES:
+            self.rebuild_indexes(cls)
+        self.remove_from_value_indexes(cls, obj.id)
+        values = []
+        for attr in cls.indexes:
+            value = getattr(obj, attr, None)
+            index = INDEXES[s_class][attr]
+            try:
+                ids = index.get(value)
+            except TypeError:
+                # Unhashable values are only found by a full scan
+                values.append(MISSING)
+                continue
+            if ids is None:
+                index[value] = obj.id
+            elif type(ids) is dict:
+                ids[obj.id] = None
+            else:
+                index[value] = {ids: None, obj.id: None}
+            values.append(value)
+        INDEXED_VALUES[s_class][obj.id] = tuple(values)
+
+    def remove_from_indexes(self, cls: type, obj_id: str):
+        """ Drop the index entries of an object of cls
+        """
+        if SORTED.get(cls.__name__):
+            self.remove_from_sorted(cls, obj_id)
+        self.remove_from_value_indexes(cls, obj_id)
+
+    def remove_from_value_indexes(self, cls: type, obj_id: str):
+        """ Drop the entries of an object of cls from the indexes of its
+        values
+        """
+        s_class = cls.__name__
+        values = INDEXED_VALUES.get(s_class, {}).pop(obj_id, ())
+        for attr, value in zip(cls.indexes, values):
+            if value is MISSING:
+                continue
+            index = INDEXES[s_class][attr]
+            ids = index[value]
+            if type(ids) is not dict:
+                del index[value]
+                continue
+            ids.pop(obj_id, None)
+            if len(ids) == 1:
+                index[value] = next(iter(ids))
+
+    def indexed_ids(self, cls: type, attr: str, value) -> Iterable[str]:
+        """ Ids of the objects of cls saved with attr == value; attr must
+        be indexed and value hashable
+        """
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            self.rebuild_indexes(cls)
+        ids = INDEXES[s_class][attr].get(value)
+        if ids is None:
+            return ()
+        return ids.copy() if type(ids) is dict else (ids,)
+
+    def sorted_keys(self, cls: type, attr: str) -> list:
+        """ The sorted index of attr for cls: sorted once on first use,
+        then kept in order by every write. Raises TypeError when the
+        values of attr don't compare
+        """
+        s_class = cls.__name__
+        index = SORTED.get(s_class, {}).get(attr)
+        if index is None:
+            with LOCK:
+                index = SORTED.get(s_class, {}).get(attr)
+                if index is None:
+                    keys_by_id = {obj.id: sort_key(obj, attr)
+                                  for obj in DATA.get(s_class, {}).values()}
+                    index = (sorted(keys_by_id.values()), keys_by_id)
+                    with SORTED_LOCK:
+                        SORTED.setdefault(s_class, {})[attr] = index
+        return index[0]
+
+    def add_to_sorted(self, obj: TypeVar('Base')):
+        """ Move obj in the sorted indexes of its class to the keys of
+        its current values: a bisection and a list insertion each
+        """
+        s_class = obj.__class__.__name__
+        with SORTED_LOCK:
+            for attr, (keys, keys_by_id) in \
+                    list(SORTED.get(s_class, {}).items()):
+                key = sort_key(obj, attr)
+                old_key = keys_by_id.get(obj.id)
+                if old_key == key:
+                    continue
+                try:
+                    if old_key is not None:
+                        del keys[bisect_left(keys, old_key)]
+                    insort(keys, key)
+                except TypeError:
+                    # A value that doesn't compare with the others: the
+                    # next ordered search sorts them again, and fails
+                    del SORTED[s_class][attr]
+                    continue
+                keys_by_id[obj.id] = key
+
+    def remove_from_sorted(self, cls: type, obj_id: str):
+        """ Drop an object of cls from the sorted indexes of cls
+        """
+        s_class = cls.__name__
+        with SORTED_LOCK:
+            for attr, (keys, keys_by_id) in \
+                    list(SORTED.get(s_class, {}).items()):
+                key = keys_by_id.pop(obj_id, None)
+                if key is None:
+                    continue
+                try:
+                    del keys[bisect_left(keys, key)]
+                except TypeError:
+                    del SORTED[s_class][attr]
+
+    def iter_sorted(self, cls: type, attr: str, start: tuple = None,
+                    descending: bool = False) -> Iterator[tuple]:
+        """ Yield the keys of the sorted index of attr for cls after the
+        key start, a chunk at a time: each chunk is a bisection and a
+        slice of the index, which writes may change in between
+        """
+        while True:
+            keys = self.sorted_keys(cls, attr)
+            with SORTED_LOCK:
+                if descending:
+                    end = len(keys) if start is None else \
+                        bisect_left(keys, start)
+                    chunk = keys[max(end - SORTED_CHUNK, 0):end]
+                    chunk.reverse()
+                else:
+                    begin = 0 if start is None else bisect_right(keys, start)
+                    chunk = keys[begin:begin + SORTED_CHUNK]
+            if not chunk:
+                return
+            yield from chunk
+            start = chunk[-1]
+
+    def persist(self, cls: type, entry: dict) -> bool:
+        """ Write a save/remove record of cls under LOCK: to the journal,
+        right away or from the write-behind flusher. Returns False when
+        it goes in a new snapshot instead, which the caller writes with
+        dump once LOCK is released
+        """
+        if WRITE_BEHIND <= 0:
+            if not JOURNAL:
+                with DIRTY_CHANGED:
+                    # Until dump writes it: sync leaves its object alone
+                    WRITING.setdefault(cls, []).append(entry)
+                return False
+            self.append_to_journal(cls, entry)
+            return True
+        with DIRTY_CHANGED:
+            # Kept for the snapshots too: sync leaves their objects alone
+            DIRTY.setdefault(cls, []).append(entry)
+            DIRTY_CHANGED.notify()
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(target=self.flush_forever,
+                                                daemon=True)
+                self.flusher.start()
+        return True
+
+    def flush(self):
+        """ Write every save and remove still waiting for the
+        write-behind flusher; returns once they are on disk
+        """
+        with FLUSH_LOCK:
+            with DIRTY_CHANGED:
+                dirty = {cls: list(entries) for cls, entries in DIRTY.items()}
+            for cls, entries in dirty.items():
+                if JOURNAL:
+                    self.append_to_journal(cls, *entries, durable=True)
+                else:
+                    self.dump(cls, entries)
+                # Dropped once written only: until then sync sees them
+                # as pending
+                with DIRTY_CHANGED:
+                    del DIRTY[cls][:len(entries)]
+                    if not DIRTY[cls]:
+                        del DIRTY[cls]
+
+    def flush_forever(self):
+        """ Body of the flusher thread: wait for a write, let more
+        writes come in for WRITE_BEHIND seconds, then flush them together
+
+        A failed flush (a full disk...) is logged and tried again after
+        FLUSH_RETRY seconds: its records stay in DIRTY until written
+        """
+        while True:
+            with DIRTY_CHANGED:
+                while not DIRTY:
+                    DIRTY_CHANGED.wait()
+            time.sleep(WRITE_BEHIND)
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("write-behind flush failed, retrying in "
+                                 "%ss", FLUSH_RETRY)
+                time.sleep(FLUSH_RETRY)
+
+    def append_to_journal(self, cls: type, *entries: dict,
+                          durable: bool = False):
+        """ Append save/remove records to the journal of cls: the cost
+        of a write no longer depends on the number of objects. With
+        durable, the journal is fsynced
+
+        The journal is written under the lock file of cls: a compaction
+        in another process may have moved it aside, and the journal is
+        then reopened
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        lines = "".join(json.dumps(entry) + "\n"
+                        for entry in entries).encode()
+        with LOCK, file_lock(".db_{}.lock".format(s_class)):
+            f = JOURNALS.get(s_class)
+            journal = stat_key(journal_path)
+            st = os.fstat(f.fileno()) if f is not None else None
+            if st is None or journal is None or journal[0] != st.st_ino:
+                if f is not None:
+                    f.close()
+                f = open(journal_path, 'ab')
+                JOURNALS[s_class] = f
+                st = os.fstat(f.fileno())
+            f.write(lines)
+            f.flush()
+            if durable:
+                os.fsync(f.fileno())
+            size = st.st_size + len(lines)
+            synced = SYNCED.get(s_class)
+            if synced is not None and \
+                    synced['journal'] == (st.st_ino, st.st_size):
+                # Nobody wrote since this process last read the journal
+                synced['journal'] = (st.st_ino, size)
+            if size < JOURNAL_MAX_BYTES:
+                return
+        self.start_compaction(cls)
+
+    def start_compaction(self, cls: type):
+        """ Compact the journal of cls in a background thread, unless a
+        compaction is already running
+        """
+        s_class = cls.__name__
+        with LOCK:
+            if s_class in COMPACTING:
+                return
+            COMPACTING.add(s_class)
+        threading.Thread(target=self.compact, args=(cls,),
+                         daemon=True).start()
+
+    def compact(self, cls: type):
+        """ Fold the journal of cls into a new snapshot
+
+        The journal is moved aside while holding LOCK, so new records
+        go to a fresh journal; the snapshot is then written without the
+        lock. Replaying the moved journal over any snapshot taken after
+        the move gives the same objects, so a crash at any point loses
+        nothing.
+
+        The records of other processes are synced before the move,
+        under the lock file of cls, and one process at a time compacts
+        """
+        s_class = cls.__name__
+        file_path = self.snapshot_path(cls)
+        journal_path = ".db_{}.journal".format(s_class)
+        compacting_path = journal_path + ".compacting"
+        COMPACTING.add(s_class)
+        try:
+            with file_lock(".db_{}.compacting.lock".format(s_class),
+                           blocking=False) as locked:
+                if not locked:
+                    # Another process is compacting this journal
+                    return
+                with LOCK, file_lock(".db_{}.lock".format(s_class)):
+                    self.sync(cls)
+                    f = JOURNALS.pop(s_class, None)
+                    if f is not None:
+                        f.close()
+                    if path.exists(journal_path) and \
+                            path.exists(compacting_path):
+                        with open(journal_path, 'rb') as src, \
+                                open(compacting_path, 'ab') as dst:
+                            dst.write(src.read())
+                        os.remove(journal_path)
+                    elif path.exists(journal_path):
+                        os.replace(journal_path, compacting_path)
+                    compacting = stat_key(compacting_path)
+                    objs = list(DATA.get(s_class, {}).values())
+                    synced = SYNCED.get(s_class)
+
+                with DUMP_LOCK:
+                    snapshot = self.write_snapshot(
+                        file_path, {obj.id: obj.to_json(True)
+                                    for obj in objs})
+                with LOCK:
+                    # A load since the move read the files itself, and
+                    # replaced the dict: its refresh sees this snapshot
+                    current = synced is not None and \
+                        SYNCED.get(s_class) is synced
+                    if current:
+                        synced['snapshot'] = snapshot
+                if compacting is not None:
+                    os.remove(compacting_path)
+                    with LOCK:
+                        if current and SYNCED.get(s_class) is synced and \
+                                synced['journal'][0] == compacting[0]:
+                            # Read in full before the move: what follows
+                            # is in the new journal
+                            synced['journal'] = (None, 0)
+        finally:
+            with LOCK:
+                COMPACTING.discard(s_class)
+
+    def dump(self, cls: type, entries: Iterable[dict] = ()):
+        """ Save all objects of cls to file, atomically
+
+        The writes of other processes are synced first, under the lock
+        file of cls, except for the objects of entries: the records
+        this dump writes
+        """
+        s_class = cls.__name__
+        file_path = self.snapshot_path(cls)
+        entries = list(entries)
+        try:
+            # Waited for without LOCK: a snapshot being written blocks
+            # neither readers nor the other writers
+            with DUMP_LOCK, ExitStack() as locks:
+                # Taken after LOCK like the other locks, but held past
+                # it: other writers go on while the snapshot is written
+                with LOCK:
+                    locks.enter_context(
+                        file_lock(".db_{}.lock".format(s_class)))
+                    self.sync(cls, [entry_id(entry) for entry in entries])
+                    objs = DATA.get(s_class, {}).copy()
+                objs_json = {}
+                for obj in objs.values():
+                    objs_json[obj.id] = obj.to_json(True)
+
+                snapshot = self.write_snapshot(file_path, objs_json)
+                synced = SYNCED.setdefault(s_class, {'journal': (None, 0)})
+                synced['snapshot'] = snapshot
+        finally:
+            with DIRTY_CHANGED:
+                writing = WRITING.get(cls, [])
+                for entry in entries:
+                    if entry in writing:
+                        writing.remove(entry)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store obj and write it
+        """
+        cls = obj.__class__
+        # Written under LOCK, the journal follows the order in which
+        # DATA changed
+        with LOCK:
+            DATA.setdefault(cls.__name__, {})[obj.id] = obj
+            self.add_to_indexes(obj)
+            # The pid tells sync which records are this process' own
+            entry = {'op': 'save', 'obj': obj.to_json(True),
+                     'pid': os.getpid()}
+            if self.persist(cls, entry):
+                return
+        # A snapshot is written past LOCK: each one copies DATA after
+        # the previous one, in DUMP_LOCK order, so the last is the newest
+        self.dump(cls, [entry])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Drop obj and write its removal
+        """
+        cls = obj.__class__
+        with LOCK:
+            objs = DATA.get(cls.__name__, {})
+            if objs.get(obj.id) is None:
+                return
+            del objs[obj.id]
+            self.remove_from_indexes(cls, obj.id)
+            entry = {'op': 'remove', 'id': obj.id, 'pid': os.getpid()}
+            if self.persist(cls, entry):
+                return
+        self.dump(cls, [entry])
+
+    def count(self, cls: type) -> int:
+        """ Count all objects of cls
+        """
+        return len(DATA.get(cls.__name__, {}))
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object of cls by ID
+        """
+        return DATA.get(cls.__name__, {}).get(id)
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects of cls with matching attributes
+
+        When an attribute of the query is indexed, only the objects
+        saved with that value are checked instead of every object; the
+        whole class is copied only to scan it
+        """
+        objs_by_id = DATA.get(cls.__name__, {})
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        objs = None
+        for k, v in attributes.items():
+            if k not in cls.indexes:
+                continue
+            try:
+                ids = self.indexed_ids(cls, k, v)
+            except TypeError:
+                continue
+            objs = [objs_by_id.get(obj_id) for obj_id in ids]
+            objs = [obj for obj in objs if obj is not None]
+            break
+        if objs is None:
+            objs = list(objs_by_id.copy().values())
+        return list(filter(_search, objs))
+
+    def iter_search(self, cls: type, attributes: dict = {},
+                    order_by: str = 'id', after: tuple = None,
+                    offset: int = 0,
+                    limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate lazily over the objects of cls with matching
+        attributes, in the order of the attribute order_by ('-' first
+        for descending), from after the (value, id) key after, skipping
+        offset of them and stopping after limit
+
+        The objects come from the sorted index of order_by, a chunk at
+        a time, so a page costs the same wherever it starts. When an
+        attribute of the query is indexed, only the objects saved with
+        that value are sorted. Raises ValueError when the values of
+        order_by, or after, don't compare
+        """
+        s_class = cls.__name__
+        descending = order_by.startswith('-')
+        attr = order_by.lstrip('-')
+        start = None if after is None else (after[0] is None, after[0],
+                                            after[1])
+        objs_by_id = DATA.get(s_class, {})
+
+        def _search(obj):
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        objs = None
+        for k, v in attributes.items():
+            if k not in cls.indexes:
+                continue
+            try:
+                ids = self.indexed_ids(cls, k, v)
+            except TypeError:
+                continue
+            objs = [objs_by_id.get(obj_id) for obj_id in ids]
+            break
+        try:
+            if objs is not None:
+                keyed = sorted((sort_key(obj, attr), obj) for obj in objs
+                               if obj is not None)
+                if descending:
+                    keyed.reverse()
+                if start is not None:
+                    keyed = [(key, obj) for key, obj in keyed
+                             if (key < start if descending
+                                 else key > start)]
+            else:
+                keys = self.sorted_keys(cls, attr)
+                if start is not None:
+                    # A start that doesn't compare fails now rather than
+                    # while iterating
+                    bisect_left(keys, start)
+                keyed = ((key, objs_by_id.get(key[2])) for key in
+                         self.iter_sorted(cls, attr, start, descending))
+        except TypeError:
+            raise ValueError("can't order {} by {} from {}".format(
+                s_class, attr, after))
+        # An object changed since its key was read is out of place: it
+        # comes at its new key, if that is still ahead
+        objs = (obj for key, obj in keyed if obj is not None and
+                sort_key(obj, attr) == key and _search(obj))
+        return islice(objs, offset, None if limit is None
+                      else offset + limit)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+""" SQLite storage engine: one table per class, in MODELS_SQLITE_PATH
+"""
+from datetime import datetime
+from itertools import islice
+from typing import TypeVar, Iterator, List
+from os import getenv
+import sqlite3
+import threading
+
+
+SQLITE_PATH = getenv("MODELS_SQLITE_PATH", ".db_models.sqlite3")
+# Types sqlite3 binds as they are; other values are compared in Python
+SQL_TYPES = (str, int, float, bytes, type(None))
+# Rows read at a time by iter_search
+SQL_CHUNK = 256
+
+
+class SQLiteStorage():
+    """ Keeps the objects of each class in a table named after it, with
+    a column per slot of the class and an index per attribute in its
+    indexes. The SQL of each class is built once, so sqlite3 reuses its
+    prepared statements; every write is committed right away
+    """
+
+    def __init__(self, db_path: str = SQLITE_PATH,
+                 timestamp_format: str = "%Y-%m-%dT%H:%M:%S"):
+        """ Initialize the storage; nothing is opened yet
+        """
+        self.db_path = db_path
+        self.timestamp_format = timestamp_format
+        self.local = threading.local()
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """ The connection of the current thread, in autocommit mode
+        """
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, isolation_level=None)
+            # Readers don't wait for writers with write-ahead logging
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    def table(self, cls: type) -> dict:
+        """ Create the table and indexes of cls on first use, and
+        return its columns and SQL statements
+        """
+        statements = self.statements.get(cls)
+        if statements is not None:
+            return statements
+        with self.lock:
+            table = '"{}"'.format(cls.__name__)
+            columns = cls.slot_names()
+            db = self.connection()
+            db.execute("CREATE TABLE IF NOT EXISTS {} "
+                       "(id TEXT PRIMARY KEY)".format(table))
+            existing = [row[1] for row in
+                        db.execute("PRAGMA table_info({})".format(table))]
+            for column in columns:
+                if column not in existing:
+                    db.execute('ALTER TABLE {} ADD COLUMN "{}"'.format(
+                        table, column))
+            for attr in cls.indexes:
+                db.execute('CREATE INDEX IF NOT EXISTS "ix_{}_{}" ON {} '
+                           '("{}")'.format(cls.__name__, attr, table, attr))
+
+            quoted = ", ".join('"{}"'.format(col) for col in columns)
+            select = "SELECT {} FROM {}".format(quoted, table)
+            statements = {
+                'columns': columns,
+                'select': select,
+                'get': select + " WHERE id = ?",
+                'count': "SELECT COUNT(*) FROM {}".format(table),
+                'insert': "INSERT INTO {} ({}) VALUES ({})".format(
+                    table, quoted, ", ".join("?" for _ in columns)),
+                'update': "UPDATE {} SET {} WHERE id = ?".format(
+                    table, ", ".join('"{}" = ?'.format(col)
+                                     for col in columns)),
+                'delete': "DELETE FROM {} WHERE id = ?".format(table),
+                'ordered': set(),
+            }
+            self.statements[cls] = statements
+        return statements
+
+    def to_object(self, cls: type, columns: tuple,
+                  row: tuple) -> TypeVar('Base'):
+        """ Build an object of cls from a row of its table
+        """
+        return cls(**dict(zip(columns, row)))
+
+    def load(self, cls: type, stream: bool = None):
+        """ Create the table of cls if needed: rows are read on demand
+        """
+        self.table(cls)
+
+    def dump(self, cls: type):
+        """ Nothing to do: every write is already committed
+        """
+        self.table(cls)
+
+    def flush(self):
+        """ Nothing to do: every write is already committed
+        """
+
+    def refresh(self, cls: type):
+        """ Nothing to do: every process reads the same database
+        """
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert obj, or update its row
+        """
+        statements = self.table(obj.__class__)
+        obj_json = obj.to_json(True)
+        values = [obj_json.get(col) for col in statements['columns']]
+        db = self.connection()
+        # An UPDATE, then an INSERT if no row matched: upserts need
+        # SQLite 3.24, newer than Ubuntu 18.04 ships
+        if db.execute(statements['update'], values + [obj.id]).rowcount:
+            return
+        db.execute(statements['insert'], values)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of obj
+        """
+        statements = self.table(obj.__class__)
+        self.connection().execute(statements['delete'], (obj.id,))
+
+    def count(self, cls: type) -> int:
+        """ Count all objects of cls
+        """
+        statements = self.table(cls)
+        return self.connection().execute(statements['count']).fetchone()[0]
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object of cls by ID
+        """
+        statements = self.table(cls)
+        row = self.connection().execute(statements['get'],
+                                        (id,)).fetchone()
+        if row is None:
+            return None
+        return self.to_object(cls, statements['columns'], row)
+
+    def conditions(self, columns: tuple, attributes: dict) -> tuple:
+        """ SQL conditions and parameters matching attributes on columns
+        (with IS, so None matches NULL), and the attributes left to
+        match with getattr as the file storage does
+        """
+        where, params, rest = [], [], {}
+        for k, v in attributes.items():
+            if type(v) is datetime:
+                v = v.strftime(self.timestamp_format)
+            if k in columns and isinstance(v, SQL_TYPES):
+                where.append('"{}" IS ?'.format(k))
+                params.append(v)
+            else:
+                rest[k] = attributes[k]
+        return where, params, rest
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects of cls with matching attributes: columns
+        are matched in SQL, anything else in Python
+        """
+        statements = self.table(cls)
+        columns = statements['columns']
+        where, params, rest = self.conditions(columns, attributes)
+        sql = statements['select']
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rowid"
+
+        objs = [self.to_object(cls, columns, row)
+                for row in self.connection().execute(sql, params)]
+        if rest:
+            objs = [obj for obj in objs
+                    if all(getattr(obj, k) == v for k, v in rest.items())]
+        return objs
+
+    def order_index(self, cls: type, attr: str):
+        """ Create the index of (attr, id) that ordered searches of cls
+        walk, on first use
+        """
+        statements = self.table(cls)
+        if attr == 'id' or attr in statements['ordered']:
+            return
+        with self.lock:
+            self.connection().execute(
+                'CREATE INDEX IF NOT EXISTS "ox_{}_{}" ON "{}" ("{}", id)'
+                .format(cls.__name__, attr, cls.__name__, attr))
+            statements['ordered'].add(attr)
+
+    def iter_search(self, cls: type, attributes: dict = {},
+                    order_by: str = 'id', after: tuple = None,
+                    offset: int = 0,
+                    limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate lazily over the objects of cls with matching
+        attributes, in the order of the column order_by ('-' first for
+        descending), from after the (value, id) key after, skipping
+        offset of them and stopping after limit
+
+        Rows are read a page at a time, each page from where the last
+        one ended on the index of (order_by, id): a page costs the same
+        wherever it starts. As in the file storage, NULLs come last in
+        ascending order and first in descending order
+        """
+        statements = self.table(cls)
+        columns = statements['columns']
+        descending = order_by.startswith('-')
+        attr = order_by.lstrip('-')
+        if attr not in columns:
+            raise ValueError("can't order {} by {}".format(
+                cls.__name__, attr))
+        self.order_index(cls, attr)
+        where, params, rest = self.conditions(columns, attributes)
+        if after is not None and type(after[0]) is datetime:
+            after = (after[0].strftime(self.timestamp_format), after[1])
+        position, id_position = columns.index(attr), columns.index('id')
+        direction = " DESC" if descending else ""
+        size = SQL_CHUNK if limit is None or rest else \
+            min(SQL_CHUNK, offset + limit)
+
+        def rows():
+            """ Yield the matching rows, the values then the NULLs of
+            attr, reversed when descending
+            """
+            start = after
+            phases = ["value", "null"]
+            if descending:
+                phases.reverse()
+            if start is not None:
+                phases = phases[phases.index(
+                    "null" if start[0] is None else "value"):]
+            for phase in phases:
+                while True:
+                    conds, values = list(where), list(params)
+                    if phase == "value":
+                        conds.append('"{}" IS NOT NULL'.format(attr))
+                        if start is not None:
+                            conds.append('("{}", id) {} (?, ?)'.format(
+                                attr, "<" if descending else ">"))
+                            values += start
+                        order = '"{}"{}, id{}'.format(attr, direction,
+                                                      direction)
+                    else:
+                        conds.append('"{}" IS NULL'.format(attr))
+                        if start is not None:
+                            conds.append("id {} ?".format(
+                                "<" if descending else ">"))
+                            values.append(start[1])
+                        order = "id" + direction
+                    sql = "{} WHERE {} ORDER BY {} LIMIT ?".format(
+                        statements['select'], " AND ".join(conds), order)
+                    page = self.connection().execute(
+                        sql, values + [size]).fetchall()
+                    yield from page
+                    if len(page) < size:
+                        break
+                    start = (page[-1][position], page[-1][id_position])
+                start = None
+
+        objs = (self.to_object(cls, columns, row) for row in rows())
+        if rest:
+            objs = (obj for obj in objs
+                    if all(getattr(obj, k) == v for k, v in rest.items()))
+        return islice(objs, offset, None if limit is None
+                      else offset + limit)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress test of the models storage: writer threads
+create, update and remove users while reader threads search, page,
+list and count them. At the end, the users in memory, their indexes
+and the users reloaded from disk must all agree. Exits with status 1 on any
+error or mismatch.
+
+Usage: ./stress_models.py [seconds] [writers] [readers]
+Set MODELS_STORAGE, MODELS_JOURNAL or MODELS_WRITE_BEHIND to stress
+another mode.
+"""
+import copy
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from models.base import storage
+from models.engine import file_storage
+from models.user import User
+
+ERRORS = []
+
+
+def writer(number: int, stop: threading.Event, alive: dict) -> None:
+    """ Create, update and remove users until stop is set """
+    rand = random.Random(number)
+    mine = []
+    i = 0
+    try:
+        while not stop.is_set():
+            action = rand.random()
+            if action < 0.5 or not mine:
+                user = User(email="w{}-{}@example.com".format(number, i))
+                user.save()
+                mine.append(user.id)
+                i += 1
+            elif action < 0.8:
+                # Updated as a copy: a reader's object never changes
+                # under it, so what it checks is what it was given
+                user = copy.copy(User.get(rand.choice(mine)))
+                user.first_name = "First{}".format(i)
+                user.email = "w{}-{}@example.com".format(number, i)
+                user.save()
+                i += 1
+            else:
+                user = User.get(mine.pop(rand.randrange(len(mine))))
+                user.remove()
+        for user_id in mine:
+            alive[user_id] = User.get(user_id).email
+    except Exception:
+        ERRORS.append(traceback.format_exc())
+
+
+def reader(number: int, stop: threading.Event) -> None:
+    """ Search, page, list and count users until stop is set """
+    rand = random.Random(-number)
+    try:
+        while not stop.is_set():
+            email = "w{}-{}@example.com".format(
+                rand.randrange(4), rand.randrange(200))
+            for user in User.search({'email': email}):
+                if user.email != email:
+                    raise AssertionError("search returned {} for {}"
+                                         .format(user.email, email))
+            User.search({'last_name': None})
+            page = [user.email for user in User.search(
+                limit=20, order_by='email', cursor=User(email=email).cursor(
+                    'email'))]
+            if page != sorted(page):
+                raise AssertionError("page out of order: {}".format(page))
+            len(User.all())
+            User.count()
+    except Exception:
+        ERRORS.append(traceback.format_exc())
+
+
+def wait_for_compactions() -> None:
+    """ Wait for the background compactions of the journal to end """
+    while file_storage.COMPACTING:
+        time.sleep(0.01)
+
+
+def check(alive: dict) -> None:
+    """ Compare memory, indexes and the reloaded storage with alive """
+    if User.count() != len(alive):
+        ERRORS.append("{} users stored, {} expected".format(
+            User.count(), len(alive)))
+    for user_id, email in alive.items():
+        found = [user.id for user in User.search({'email': email})]
+        if user_id not in found:
+            ERRORS.append("{} not found by email {}".format(user_id, email))
+    ordered = [user.id for user in User.search(order_by='email')]
+    if ordered != [user.id for user in sorted(
+            User.all(), key=lambda user: (user.email, user.id))]:
+        ERRORS.append("users ordered by email differ from a sort")
+    storage.flush()
+    # A compaction folding the journal meanwhile would make the reload
+    # depend on timing; the reload may start one too
+    wait_for_compactions()
+    User.load_from_file()
+    wait_for_compactions()
+    reloaded = {user.id: user.email for user in User.all()}
+    if reloaded != alive:
+        ERRORS.append("reloaded {} users, {} differ from memory".format(
+            len(reloaded), len(set(reloaded.items()) ^ set(alive.items()))))
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    # Switch threads often to make races likely
+    sys.setswitchinterval(1e-6)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        User.load_from_file()
+        stop = threading.Event()
+        alive = {}
+        threads = [threading.Thread(target=writer, args=(i, stop, alive))
+                   for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(i, stop))
+                    for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        writes = User.count()
+        check(alive)
+    for error in ERRORS:
+        print(error, file=sys.stderr)
+    print("{} writers, {} readers, {:.0f}s: {} users left, {} errors".format(
+        writers, readers, seconds, writes, len(ERRORS)))
+    sys.exit(1 if ERRORS else 0)
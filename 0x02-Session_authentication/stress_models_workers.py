@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+""" Multi-process stress test of the file storage, the way several
+gunicorn workers share it: each worker loads the users once, then
+creates, updates and removes its own users while reading everyone's.
+At the end, after one refresh interval, every worker must see the same
+users as a fresh load, and no worker may have lost one of its own.
+Exits with status 1 on any error or mismatch.
+
+Usage: ./stress_models_workers.py [seconds] [workers]
+Set MODELS_JOURNAL, MODELS_WRITE_BEHIND or MODELS_SNAPSHOT_FORMAT to
+stress another mode.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import traceback
+
+from models.base import storage
+from models.engine import file_storage
+from models.user import User
+
+
+def worker(number: int, seconds: float, barrier, results) -> None:
+    """ Write and read users for `seconds`, then report what this
+    worker kept and what it sees
+    """
+    rand = random.Random(number)
+    mine = {}
+    errors = []
+    i = 0
+    try:
+        User.load_from_file()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            action = rand.random()
+            if action < 0.5 or not mine:
+                user = User(email="w{}-{}@example.com".format(number, i))
+            else:
+                user = User.get(rand.choice(list(mine)))
+                if user is None or user.email != mine[user.id]:
+                    raise AssertionError("worker {} lost a user".format(
+                        number))
+            if action < 0.8 or not mine:
+                user.email = "w{}-{}@example.com".format(number, i)
+                user.save()
+                mine[user.id] = user.email
+                i += 1
+            else:
+                user.remove()
+                del mine[user.id]
+            User.search({'email': "w{}-{}@example.com".format(
+                rand.randrange(8), rand.randrange(i + 1))})
+            User.count()
+        storage.flush()
+    except Exception:
+        errors.append(traceback.format_exc())
+    barrier.wait()
+    # Every worker wrote its last user: the next read refreshes
+    time.sleep(max(file_storage.REFRESH_INTERVAL, 0) + 0.05)
+    seen = {user.id: user.email for user in User.all()}
+    results.put((mine, seen, errors))
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    if file_storage.REFRESH_INTERVAL < 0:
+        sys.exit("MODELS_REFRESH_INTERVAL turns the refresh off")
+    context = multiprocessing.get_context("fork")
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=worker,
+                                     args=(i, seconds, barrier, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        # No compaction of this process may outlive the directory
+        file_storage.JOURNAL_MAX_BYTES = 2 ** 62
+        User.load_from_file()
+        loaded = {user.id: user.email for user in User.all()}
+    alive = {}
+    for mine, seen, worker_errors in reports:
+        errors.extend(worker_errors)
+        alive.update(mine)
+        if seen != loaded:
+            errors.append("a worker sees {} users, {} differ from a load"
+                          .format(len(seen),
+                                  len(set(seen.items()) ^
+                                      set(loaded.items()))))
+    if alive != loaded:
+        errors.append("{} users loaded, {} differ from what the workers "
+                      "kept".format(len(loaded), len(set(alive.items()) ^
+                                                     set(loaded.items()))))
+    for error in errors:
+        print(error, file=sys.stderr)
+    print("{} workers, {:.0f}s: {} users left, {} errors".format(
+        workers, seconds, len(loaded), len(errors)))
+    sys.exit(1 if errors else 0)